@@ -2,13 +2,13 @@ import datetime
 import sqlite3
 import re
 import getpass
-from keys import encrypt_private_key, generate_keys, read_key, fetch_decrypted_private_key
+from keys import encrypt_private_key, generate_keys, read_key, fetch_decrypted_private_key, session_key
 from recover_key import generate_random_mnemonic
 from block_validation import automatic_tasks
-from utils import BLOCK_STATUS, calculate_spendable_balance, display_menu_and_get_choice, get_user_transactions, print_header, get_current_user_public_key, find_index_from_file, remove_from_file , calculate_balance, calculate_pending_balance
+from utils import BLOCK_STATUS, calculate_spendable_balance, balance_index, display_menu_and_get_choice, get_user_transactions, print_header, get_current_user_address, address_of, fetch_username_by_address, find_txid_from_file
 from database import Database
 from transaction import transaction_pool, Transaction, REWARD, REWARD_VALUE
-from storage import transactions_file_path, blockchain_file_path, load_from_file
+from storage import block_log, transaction_journal
 import hashlib
 from wallet_client import send_data_to_miner_servers, send_data_to_wallet_servers, data_type_wallet, data_type_miner
 
@@ -112,6 +112,7 @@ class User:
 
         # reward user
         self.current_user = username
+        session_key.open(username)
         self.reward_user()
         print_header(username)
 
@@ -139,6 +140,7 @@ class User:
             print('Login successful')
             self.current_user = username
             user_object.current_user = username
+            session_key.open(username)
         else:
             print_header()
             print('Invalid username or password')
@@ -148,6 +150,7 @@ class User:
         print_header()
         print("You've been logged out")
         self.current_user = None
+        session_key.close()
 
     def change_username(self):
         new_username = input('Enter a new username: ').lower()
@@ -167,6 +170,7 @@ class User:
             send_data_to_wallet_servers((data_type_wallet[2], self.current_user, new_username))
             print_header(new_username)
             print('Username successfully changed')
+            session_key.rename(self.current_user, new_username)
             self.current_user = new_username
         except sqlite3.IntegrityError:
             print_header(self.current_user)
@@ -207,14 +211,14 @@ class User:
 
     def reward_user(self):
         decrypted_private_key = fetch_decrypted_private_key(self.current_user)
-        public_key = get_current_user_public_key(self.current_user)
+        address = get_current_user_address(self.current_user)
         reward_transaction = Transaction(type=REWARD)
 
         # Since it's a reward, there are no inputs.
-        reward_transaction.add_output(public_key, REWARD_VALUE)
+        reward_transaction.add_output(address, REWARD_VALUE)
         reward_transaction.sign(decrypted_private_key)
 
-        transaction_pool.add_transaction(reward_transaction, transactions_file_path)
+        transaction_pool.add_transaction(reward_transaction)
         send_data_to_miner_servers((data_type_miner[1], reward_transaction))
 
     def transfer_coins(self):
@@ -245,24 +249,8 @@ class User:
             return
 
         # check if enough balance [amount_to_transfer + transfer_fee <= available balance - (pending balance from pool + pending balance from blocks)]
-        chain = load_from_file(blockchain_file_path) 
-        public_key = get_current_user_public_key(self.current_user)
-        available_balance = 0
-        pending_balance = 0
-        spendable_balance = 0
-        for block in chain:
-            if block.status == BLOCK_STATUS[1] and block.transactions[-1].output[0] == public_key:
-                available_balance += calculate_balance(public_key, block.transactions, True)
-            elif block.status == BLOCK_STATUS[1]:
-                available_balance += calculate_balance(public_key, block.transactions)
-            elif block.status == BLOCK_STATUS[0] and block.transactions[-1].output[0] == public_key:
-                pending_balance += calculate_balance(public_key, block.transactions, True)
-            elif block.status == BLOCK_STATUS[0]: # balance from pending blocks
-                pending_balance += calculate_balance(public_key, block.transactions)
-
-        pool_transactions = load_from_file(transactions_file_path) 
-        if pool_transactions:
-            spendable_balance += calculate_spendable_balance(public_key, pool_transactions)
+        address = get_current_user_address(self.current_user)
+        available_balance, pending_balance, spendable_balance = balance_index.balances(address)
 
         if (amount_to_transfer + transaction_fee) > available_balance:
             print_header(self.current_user)
@@ -303,9 +291,9 @@ class User:
         # make the transaction
         transaction = Transaction(0, transaction_fee)
         private_key = fetch_decrypted_private_key(self.current_user)
-        public_key_receiver = get_current_user_public_key(receiver_username)
-        transaction.add_input(public_key, amount_to_transfer)
-        transaction.add_output(public_key_receiver,amount_to_transfer)
+        receiver_address = get_current_user_address(receiver_username)
+        transaction.add_input(address, amount_to_transfer)
+        transaction.add_output(receiver_address,amount_to_transfer)
 
         # sign transaction
         transaction.sign(private_key)
@@ -317,7 +305,7 @@ class User:
             return
 
         # add to the pool
-        transaction_pool.add_transaction(transaction, transactions_file_path)
+        transaction_pool.add_transaction(transaction)
         send_data_to_miner_servers((data_type_miner[1], transaction))
 
         print_header(self.current_user)
@@ -326,7 +314,7 @@ class User:
     def remove_transaction(self):
         print_header(self.current_user)
         # show all user transactions from the pool
-        transactions = get_user_transactions(transactions_file_path, self.current_user) # [number, input amount, username sender, fee]
+        transactions = get_user_transactions(self.current_user) # [number, input amount, username sender, fee]
         if transactions == []:
             print_header(self.current_user)
             print("You have no pending transactions")
@@ -359,9 +347,9 @@ class User:
                 return
             
             # delete from pool
-            index = find_index_from_file(transactions_file_path, transactions[choice-1][1], get_current_user_public_key(self.current_user), get_current_user_public_key(transactions[choice-1][2]), transactions[choice-1][3])
-            remove = remove_from_file(transactions_file_path, index)
-            send_data_to_miner_servers((data_type_miner[2], index))
+            txid, _ = find_txid_from_file(transactions[choice-1][1], get_current_user_address(self.current_user), get_current_user_address(transactions[choice-1][2]), transactions[choice-1][3])
+            remove = transaction_journal.remove({txid})
+            send_data_to_miner_servers((data_type_miner[2], {txid}))
             if remove:
                 print_header(self.current_user)
                 print("Transaction canceled")
@@ -371,7 +359,7 @@ class User:
             return
 
     def edit_transaction(self):
-        transactions = get_user_transactions(transactions_file_path, self.current_user) # [number, input amount, username sender, fee]
+        transactions = get_user_transactions(self.current_user) # [number, input amount, username sender, fee]
         if transactions == []:
             print_header(self.current_user)
             print("You have no pending transactions")
@@ -413,9 +401,9 @@ class User:
         else:
             tx = Transaction(0, transactions[tx_choice][3])
             private_key = fetch_decrypted_private_key(self.current_user)
-            public_key = get_current_user_public_key(self.current_user)
-            public_key_receiver = get_current_user_public_key(transactions[tx_choice][2])
-            index = find_index_from_file(transactions_file_path, transactions[tx_choice][1],  public_key, public_key_receiver, transactions[tx_choice][3])
+            address = get_current_user_address(self.current_user)
+            receiver_address = get_current_user_address(transactions[tx_choice][2])
+            txid, old_tx = find_txid_from_file(transactions[tx_choice][1],  address, receiver_address, transactions[tx_choice][3])
             if edit_choice == 2:
                 new_username = input("Enter new username: ").replace(" ", "").lower()
                 if not self.validate_username(new_username) or not self.username_exists(new_username):
@@ -427,9 +415,9 @@ class User:
                     print("That's the same username")
                     return
 
-                public_key_new_receiver = get_current_user_public_key(new_username)
-                tx.add_input(public_key, transactions[tx_choice][1])
-                tx.add_output(public_key_new_receiver, transactions[tx_choice][1])
+                new_receiver_address = get_current_user_address(new_username)
+                tx.add_input(address, transactions[tx_choice][1])
+                tx.add_output(new_receiver_address, transactions[tx_choice][1])
 
             elif edit_choice == 3:
                 new_fee = input("Enter new transaction fee: ")
@@ -449,25 +437,10 @@ class User:
                     return
 
                 # check if enough balance
-                chain = load_from_file(blockchain_file_path)
-                pool_transactions = load_from_file(transactions_file_path)
-                available_balance = 0
-                pending_balance = 0
-                spendable_balance = 0
                 temp_amount = transactions[tx_choice][1]
-                del pool_transactions[index] # skip the editting transaction when calculating balance
-                for block in chain:
-                    if block.status == BLOCK_STATUS[1] and block.transactions[-1].output[0] == public_key:
-                        available_balance += calculate_balance(public_key, block.transactions, True)
-                    elif block.status == BLOCK_STATUS[1]:
-                        available_balance += calculate_balance(public_key, block.transactions)
-                    elif block.status == BLOCK_STATUS[0] and block.transactions[-1].output[0] == public_key:
-                        pending_balance += calculate_balance(public_key, block.transactions, True)
-                    elif block.status == BLOCK_STATUS[0]: # balance from pending blocks
-                        pending_balance += calculate_balance(public_key, block.transactions)
-
-                if pool_transactions:
-                    spendable_balance += calculate_spendable_balance(public_key,pool_transactions)
+                available_balance, pending_balance, spendable_balance = balance_index.balances(address)
+                # skip the editting transaction when calculating balance
+                spendable_balance -= calculate_spendable_balance(address, [old_tx])
 
                 if (new_fee + temp_amount) > available_balance:
                     print_header(self.current_user)
@@ -490,8 +463,8 @@ class User:
                     return
               
                 tx.fee = new_fee
-                tx.add_input(public_key, transactions[tx_choice][1])
-                tx.add_output(public_key_receiver,transactions[tx_choice][1])
+                tx.add_input(address, transactions[tx_choice][1])
+                tx.add_output(receiver_address,transactions[tx_choice][1])
 
             elif edit_choice == 1:
                 new_amount = input("Enter new amount: ")
@@ -511,31 +484,17 @@ class User:
                     return
 
                 # check if enough balance
-                chain = load_from_file(blockchain_file_path)
-                pool_transactions = load_from_file(transactions_file_path)
-                available_balance = 0
-                pending_balance = 0
                 temp_fee = transactions[tx_choice][3]
                 temp_amount = transactions[tx_choice][1]
-                del pool_transactions[index]  #exclude selected transaction
-                for block in chain:
-                    if block.status == BLOCK_STATUS[1] and block.transactions[-1].output[0] == public_key:
-                        available_balance += calculate_balance(public_key, block.transactions, True)
-                    elif block.status == BLOCK_STATUS[1]:
-                        available_balance += calculate_balance(public_key, block.transactions)
-                    elif block.status == BLOCK_STATUS[0]:
-                        pending_balance += calculate_pending_balance(public_key, block.transactions)
-
-                if pool_transactions:
-                    pending_balance += calculate_pending_balance(public_key,pool_transactions)
-
-                if (new_amount + temp_fee) > (available_balance - pending_balance):
+                available_balance = balance_index.verified_balance(address)
+
+                if (new_amount + temp_fee) > available_balance:
                     print_header(self.current_user)
                     print("Insufficient balance")
                     return
         
-                tx.add_input(public_key, new_amount)
-                tx.add_output(public_key_receiver, new_amount)
+                tx.add_input(address, new_amount)
+                tx.add_output(receiver_address, new_amount)
 
             tx.sign(private_key)
             
@@ -547,8 +506,8 @@ class User:
                 return
             
             # remove old transaction
-            remove = remove_from_file(transactions_file_path, index)
-            send_data_to_miner_servers((data_type_miner[2], index))
+            remove = transaction_journal.remove({txid})
+            send_data_to_miner_servers((data_type_miner[2], {txid}))
 
             # check validation after old one is removed
             if not tx.is_valid(): 
@@ -558,7 +517,7 @@ class User:
             
             # add transaction
             if remove:
-                transaction_pool.add_transaction(tx, transactions_file_path)
+                transaction_pool.add_transaction(tx)
                 send_data_to_miner_servers((data_type_miner[1], tx))
                 print_header(self.current_user)
                 print('Transaction modified successfully')
@@ -570,10 +529,9 @@ class User:
             
     def view_transaction_history(self):
         print_header(self.current_user)
-        db = Database()
-        transaction_pool = load_from_file(transactions_file_path) 
-        chain = load_from_file(blockchain_file_path) 
-        public_key = get_current_user_public_key(self.current_user)
+        transaction_pool = transaction_journal.load()
+        chain = block_log.load() 
+        address = get_current_user_address(self.current_user)
         options = [
         {"option": "1", "text": "Back to main menu", "action": lambda: "back"}
         ]
@@ -585,16 +543,16 @@ class User:
 
         for tx in transaction_pool:
             if tx.type == 0:
-                if tx.input[0] == public_key:
-                    get_receiver_username = db.fetch('SELECT username FROM users WHERE publickey=?', (tx.output[0], ))
+                if address_of(tx.input[0]) == address:
+                    get_receiver_username = fetch_username_by_address(tx.output[0])
                     pending_transactions_to_display += f"{count_pending}. {datetime.datetime.fromtimestamp(tx.timestamp).strftime('%d-%m-%Y %H:%M:%S')} Sending: {tx.input[1]} coin(s) to {get_receiver_username[0][0]} including transaction fee of {tx.fee} coin(s)\n"
                     count_pending += 1
-                elif tx.output[0] == public_key:
-                    get_sender_username = db.fetch('SELECT username FROM users WHERE publickey=?', (tx.input[0], ))
+                elif address_of(tx.output[0]) == address:
+                    get_sender_username = fetch_username_by_address(tx.input[0])
                     pending_transactions_to_display += f"{count_pending}. {datetime.datetime.fromtimestamp(tx.timestamp).strftime('%d-%m-%Y %H:%M:%S')} Receiving: {tx.output[1]} coin(s) from {get_sender_username[0][0]} including transaction fee of {tx.fee} coin(s)\n"
                     count_pending += 1
             else:
-                if tx.output[0] == public_key:
+                if address_of(tx.output[0]) == address:
                     pending_transactions_to_display += f"{count_pending}. {datetime.datetime.fromtimestamp(tx.timestamp).strftime('%d-%m-%Y %H:%M:%S')} Receiving reward: {tx.output[1]} coin(s)\n"
                     count_pending += 1
 
@@ -604,32 +562,32 @@ class User:
             if block.status == BLOCK_STATUS[0]:
                 for tx in block.transactions:
                     if tx.type == 0:
-                        if tx.input[0] == public_key:
-                            get_receiver_username = db.fetch('SELECT username FROM users WHERE publickey=?', (tx.output[0], ))
+                        if address_of(tx.input[0]) == address:
+                            get_receiver_username = fetch_username_by_address(tx.output[0])
                             pending_transactions_to_display += f"{count_pending}. {datetime.datetime.fromtimestamp(tx.timestamp).strftime('%d-%m-%Y %H:%M:%S')} Sending: {tx.input[1]} coin(s) to {get_receiver_username[0][0]} including transaction fee of {tx.fee} coin(s)\n"
                             count_pending += 1
-                        elif tx.output[0] == public_key:
-                            get_sender_username = db.fetch('SELECT username FROM users WHERE publickey=?', (tx.input[0], ))
+                        elif address_of(tx.output[0]) == address:
+                            get_sender_username = fetch_username_by_address(tx.input[0])
                             pending_transactions_to_display += f"{count_pending}. {datetime.datetime.fromtimestamp(tx.timestamp).strftime('%d-%m-%Y %H:%M:%S')} Receiving: {tx.output[1]} coin(s) from {get_sender_username[0][0]} including transaction fee of {tx.fee} coin(s)\n"
                             count_pending += 1
                     else:
-                        if tx.output[0] == public_key:
+                        if address_of(tx.output[0]) == address:
                             pending_transactions_to_display += f"{count_pending}. {datetime.datetime.fromtimestamp(tx.timestamp).strftime('%d-%m-%Y %H:%M:%S')} Receiving reward: {tx.output[1]} coin(s)\n"
                             count_pending += 1
             # transactions from valid blocks
             elif block.status == BLOCK_STATUS[1]:
                 for tx in block.transactions:
                     if tx.type == 0:
-                        if tx.input[0] == public_key:
-                            get_receiver_username = db.fetch('SELECT username FROM users WHERE publickey=?', (tx.output[0], ))
+                        if address_of(tx.input[0]) == address:
+                            get_receiver_username = fetch_username_by_address(tx.output[0])
                             validated_transactions_to_display += f"{count_val}. {datetime.datetime.fromtimestamp(tx.timestamp).strftime('%d-%m-%Y %H:%M:%S')} Sending: {tx.input[1]} coin(s) to {get_receiver_username[0][0]} including transaction fee of {tx.fee} coin(s)\n"
                             count_val += 1
-                        elif tx.output[0] == public_key:
-                            get_sender_username = db.fetch('SELECT username FROM users WHERE publickey=?', (tx.input[0], ))
+                        elif address_of(tx.output[0]) == address:
+                            get_sender_username = fetch_username_by_address(tx.input[0])
                             validated_transactions_to_display += f"{count_val}. {datetime.datetime.fromtimestamp(tx.timestamp).strftime('%d-%m-%Y %H:%M:%S')} Receiving: {tx.output[1]} coin(s) from {get_sender_username[0][0]} including transaction fee of {tx.fee} coin(s)\n"
                             count_val += 1
                     else:
-                        if tx.output[0] == public_key:
+                        if address_of(tx.output[0]) == address:
                             validated_transactions_to_display += f"{count_val}. {datetime.datetime.fromtimestamp(tx.timestamp).strftime('%d-%m-%Y %H:%M:%S')} Receiving reward: {tx.output[1]} coin(s)\n"
                             count_val += 1
 
@@ -1,41 +1,44 @@
-from blockchain import Blockchain, check_validators
-from miner_client import send_data_to_miner_servers, data_type_miner 
+from blockchain import Blockchain, check_validators, send_block_flags
 from transaction import cancel_invalid_transactions
 from utils import display_menu_and_get_choice, get_username_miner, print_header, BLOCK_STATUS
-from storage import load_from_file, save_to_file, blockchain_file_path
+from storage import block_log
 
 
 def block_valid(current_user):
-    # check if there is a pending block
-    chain = load_from_file(blockchain_file_path)
+    # check if there is a pending block, reading only the blocks involved
+    chain_length = len(block_log)
 
-    if len(chain) <= 1:
+    if chain_length <= 1:
         return
     
-    previous_block = chain[-2] if len(chain) > 2 else chain[0]
-    miner_username = get_username_miner(blockchain_file_path, -1)
+    last_block = block_log.read(-1)
+    previous_block = block_log.read(-2) if chain_length > 2 else block_log.read(0)
+    miner_username = get_username_miner(-1)
     # if there is a pending block
-    if chain[-1].status == BLOCK_STATUS[0] and miner_username != current_user:
+    if last_block.status == BLOCK_STATUS[0] and miner_username != current_user:
         # check if already validated by current user
-        if chain[-1].validators:
-            for user, type in chain[-1].validators:
+        if last_block.validators:
+            for user, type in last_block.validators:
                 if user == current_user:
                     return
         # check if block is valid
-        validation = chain[-1].is_valid(previous_block, current_user)
+        validation = last_block.is_valid(previous_block, current_user)
         # flag it
         if validation:
-            chain[-1].validators.append((current_user, "valid"))                               
+            last_block.validators.append((current_user, "valid"))                               
         else:
-            chain[-1].validators.append((current_user, "invalid"))
+            last_block.validators.append((current_user, "invalid"))
         
         # check if there are enough validators
-        if len(chain[-1].validators) >= 3:
+        if len(last_block.validators) >= 3:
+            chain = block_log.load(copy=True)
+            chain[-1] = last_block
+            send_block_flags(chain_length - 1, last_block, current_user)
             check_validators(chain, miner_username)
         else:
             #update ledger
-            save_to_file(chain, blockchain_file_path)
-            send_data_to_miner_servers((data_type_miner[3], chain))
+            block_log.update(chain_length - 1, last_block)
+            send_block_flags(chain_length - 1, last_block, current_user)
     return
 
 def automatic_tasks(username):
@@ -49,7 +52,8 @@ def automatic_tasks(username):
 def validation_chain(current_user):
     print_header(current_user)
     block_chain = Blockchain()
-    block_chain.chain = load_from_file(blockchain_file_path)
+    # validation flags the blocks it checks
+    block_chain.chain = block_log.load(copy=True)
     text = ""
     # if file is empty return
     if not block_chain.chain:
@@ -2,18 +2,49 @@ import time
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
 from notifications import notification
-from transaction import REWARD_VALUE, REWARD, Transaction, transaction_pool
+from transaction import REWARD_VALUE, REWARD, Mempool, Transaction, transaction_pool
 from keys import fetch_decrypted_private_key
 from storage import *
 from utils import *
 import os
 import datetime
+import struct
+import hashlib
+from codec import FORMAT_VERSION, LENGTH, TAG, P384_DER_LENGTH, Reader, cached_pem, encode_number, decode_number, encode_text, decode_text, fixed_hash, encode_validators, decode_validators
 from miner_client import send_data_to_miner_servers, data_type_miner
+from mining import MINING_WORKERS, find_nonce, mining_cancelled
+from verification import verify_blocks
 from wallet_client import send_data_to_wallet_servers, data_type_wallet
 
 DIFFICULTY = 5
+BLOCK_HEADER = struct.Struct("<BIQBB") # format version, id, nonce, difficulty, status
+BLOCK_FORMAT_VERSION = 2 # version 1 records predate the hash version and the Merkle root
+BLOCK_RECORD_VERSION = 3 # fixed-width record, used whenever every field has a fixed-width form
+BLOCK_RECORD = struct.Struct("<BIQBBBBd32s32s32s") # format version, id, nonce, difficulty, status, hash version, layout, timestamp, previous hash, hash, Merkle root
+# layout bits: which of the three hashes are set (the others are None), whether PEM keys refer to the block log's key table
+LAYOUT_PREVIOUS_HASH = 1
+LAYOUT_HASH = 2
+LAYOUT_MERKLE_ROOT = 4
+LAYOUT_SHARED_KEYS = 8
+NO_HASH = bytes(32)
+HASH_VERSION_LEGACY = 1 # hash over str() of the timestamp, all transactions and the previous hash
+HASH_VERSION_MERKLE = 2 # hash over a fixed size header holding the Merkle root of the transactions
+MERKLE_HEADER = struct.Struct("<32sdB") # Merkle root, timestamp, difficulty
+
+def compute_merkle_root(transactions):
+    # pairs are hashed up to a single root, an odd one out is paired with itself
+    level = [tx.digest() for tx in transactions]
+    if not level:
+        return bytes(32).hex()
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        level = [hashlib.sha256(level[i] + level[i + 1]).digest() for i in range(0, len(level), 2)]
+    return level[0].hex()
 
 class Block:
+    __slots__ = ("id", "timestamp", "transactions", "previous_hash", "nonce", "hash", "validators", "status", "difficulty", "header_version", "merkle_root")
+
     def __init__(self, transactions, previous_hash, block_id, nonce=0):
         self.id = block_id
         self.timestamp = time.time()
@@ -24,28 +55,42 @@ class Block:
         self.validators = []
         self.status = BLOCK_STATUS[0]
         self.difficulty = DIFFICULTY
+        self.header_version = HASH_VERSION_MERKLE
+        self.merkle_root = compute_merkle_root(transactions)
+
+    def hash_prefix(self):
+        # everything that is hashed in front of the nonce, it doesn't change while mining
+        if self.header_version == HASH_VERSION_LEGACY:
+            return bytes(str(self.timestamp) + str(self.transactions) + str(self.previous_hash), 'utf8')
+        return encode_text(self.previous_hash) + MERKLE_HEADER.pack(bytes.fromhex(self.merkle_root), self.timestamp, self.difficulty)
+
+    def has_valid_merkle_root(self):
+        # legacy blocks hash their transactions directly
+        return self.header_version == HASH_VERSION_LEGACY or self.merkle_root == compute_merkle_root(self.transactions)
 
     def compute_hash(self):
         digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
-        digest.update(bytes(str(self.timestamp) + str(self.transactions) + str(self.previous_hash) + str(self.nonce), 'utf8'))
+        digest.update(self.hash_prefix() + bytes(str(self.nonce), 'utf8'))
         return digest.finalize().hex()
 
     def mine(self, difficulty, username):
         print_header(username)
         print(f"Mining...")
-        pattern = '0' * difficulty
         start_time = time.time()
-        while True:
-            transactions = load_from_file(transactions_file_path)
-            if transactions == []:
-                return None
-            self.hash = self.compute_hash()
-            if self.hash[:difficulty] == pattern:
-                break 
-            self.nonce += 1
+        if transaction_journal.load() == []:
+            return None
+        self.difficulty = difficulty
+        self.merkle_root = compute_merkle_root(self.transactions)
+        # stop once another node's block arrives, someone else mined these transactions
+        nonce, hashes_done = find_nonce(self.hash_prefix(), difficulty, self.nonce, mining_cancelled.is_set)
+        if nonce is None:
+            return None
+        self.nonce = nonce
+        self.hash = self.compute_hash()
         end_time = time.time()
         print_header(username)
         print(f"Block mined in {end_time - start_time:.0f} seconds.")
+        print(f"Hashrate: {hashes_done / max(end_time - start_time, 0.001) / 1000:.0f} kH/s on {MINING_WORKERS} cores")
         return difficulty
 
     def is_valid(self, previousBlock, username):
@@ -62,6 +107,10 @@ class Block:
 
         if invalid_tx:
             return False
+
+        #check the Merkle root against the transactions
+        if not self.has_valid_merkle_root():
+            return False
         
         #check the hash of the current block
         calculate_hash = self.compute_hash()
@@ -78,10 +127,134 @@ class Block:
                 
         return self.previous_hash == previousBlock.compute_hash()
 
+    def to_bytes(self, keys=None):
+        # compact binary form, transactions are written inline in their own format.
+        # The PEM keys of legacy transactions are written once: in the key table of
+        # the block log when it passes its {DER: index} table as keys, otherwise in
+        # a table of the block's own in front of its transactions.
+        layout = LAYOUT_SHARED_KEYS if keys is not None else 0
+        data = self._record_bytes(layout)
+        if data is None:
+            data = self._tagged_bytes() + encode_validators(self.validators) + LENGTH.pack(len(self.transactions))
+            for tx in self.transactions:
+                data += tx.to_bytes()
+            return data
+        if keys is None:
+            keys = {}
+            transactions = b"".join(tx.to_bytes(keys) for tx in self.transactions)
+            data += encode_validators(self.validators) + LENGTH.pack(len(keys)) + b"".join(keys)
+        else:
+            transactions = b"".join(tx.to_bytes(keys) for tx in self.transactions)
+            data += encode_validators(self.validators)
+        return data + LENGTH.pack(len(self.transactions)) + transactions
+
+    def _record_bytes(self, layout):
+        # the fixed-width header, None when a field has no exact fixed-width form (the genesis "0" for one)
+        if type(self.timestamp) is not float or not 0 <= self.id < 2 ** 32 or not 0 <= self.nonce < 2 ** 64:
+            return None
+        hashes = []
+        for value, flag in ((self.previous_hash, LAYOUT_PREVIOUS_HASH), (self.hash, LAYOUT_HASH), (self.merkle_root, LAYOUT_MERKLE_ROOT)):
+            if value is None:
+                hashes.append(NO_HASH)
+                continue
+            raw = fixed_hash(value)
+            if raw is None:
+                return None
+            layout |= flag
+            hashes.append(raw)
+        return BLOCK_RECORD.pack(BLOCK_RECORD_VERSION, self.id, self.nonce, self.difficulty, BLOCK_STATUS.index(self.status),
+                                 self.header_version, layout, self.timestamp, *hashes)
+
+    def _tagged_bytes(self):
+        data = BLOCK_HEADER.pack(BLOCK_FORMAT_VERSION, self.id, self.nonce, self.difficulty, BLOCK_STATUS.index(self.status))
+        data += encode_number(self.timestamp) + encode_text(self.previous_hash) + encode_text(self.hash)
+        return data + TAG.pack(self.header_version) + encode_text(self.merkle_root)
+
+    @classmethod
+    def from_bytes(cls, data, keys=None):
+        # keys is the block log's key table, PEM keys by index
+        reader = Reader(data)
+        if data[0] == BLOCK_RECORD_VERSION:
+            return cls._read_record(reader, keys)
+        version, block_id, nonce, difficulty, status = reader.unpack(BLOCK_HEADER)
+        if version not in (FORMAT_VERSION, BLOCK_FORMAT_VERSION):
+            raise ValueError(f"Unknown block format version {version}")
+        block = cls.__new__(cls)
+        block.id = block_id
+        block.nonce = nonce
+        block.difficulty = difficulty
+        block.status = BLOCK_STATUS[status]
+        block.timestamp = decode_number(reader)
+        block.previous_hash = decode_text(reader)
+        block.hash = decode_text(reader)
+        block.header_version = HASH_VERSION_LEGACY
+        block.merkle_root = None
+        if version >= BLOCK_FORMAT_VERSION:
+            block.header_version = reader.tag()
+            block.merkle_root = decode_text(reader)
+        block.validators = decode_validators(reader)
+        block.transactions = [Transaction.read_from(reader) for _ in range(reader.unpack(LENGTH)[0])]
+        return block
+
+    @classmethod
+    def _read_record(cls, reader, keys):
+        (_, block_id, nonce, difficulty, status, header_version, layout, timestamp,
+         previous_hash, block_hash, merkle_root) = reader.unpack(BLOCK_RECORD)
+        block = cls.__new__(cls)
+        block.id = block_id
+        block.nonce = nonce
+        block.difficulty = difficulty
+        block.status = BLOCK_STATUS[status]
+        block.header_version = header_version
+        block.timestamp = timestamp
+        block.previous_hash = previous_hash.hex() if layout & LAYOUT_PREVIOUS_HASH else None
+        block.hash = block_hash.hex() if layout & LAYOUT_HASH else None
+        block.merkle_root = merkle_root.hex() if layout & LAYOUT_MERKLE_ROOT else None
+        block.validators = decode_validators(reader)
+        if not layout & LAYOUT_SHARED_KEYS:
+            keys = [cached_pem(reader.take(P384_DER_LENGTH)) for _ in range(reader.unpack(LENGTH)[0])]
+        elif keys is None:
+            raise ValueError(f"block {block_id} refers to a key table it was read without")
+        try:
+            block.transactions = [Transaction.read_from(reader, keys) for _ in range(reader.unpack(LENGTH)[0])]
+        except IndexError:
+            raise ValueError(f"block {block_id} refers to a key missing from the key table")
+        return block
+
+    def __reduce__(self):
+        # pickles (network messages) carry the compact form
+        return (Block.from_bytes, (self.to_bytes(),))
+
+    def __setstate__(self, state):
+        # blocks pickled before __slots__ carry their __dict__
+        if isinstance(state, tuple):
+            state = state[1]
+        self.header_version = HASH_VERSION_LEGACY
+        self.merkle_root = None
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def __repr__(self):
         return f"Block(\n\tid: {self.id}, \n\ttimestamp: {self.timestamp}, \n\ttransactions: {self.transactions}, \n\tprevious_hash: {self.previous_hash}, \n\tnonce: {self.nonce}, \n\thash: {self.hash}\n)"
 
 
+register_codec(RECORD_BLOCK, Block.to_bytes, Block.from_bytes)
+
+
+def load_validation_checkpoint(username):
+    # (height, recomputed block hash) of the last block validated up to
+    if not os.path.isfile(validation_checkpoint_path):
+        return None
+    checkpoints = load_from_file(validation_checkpoint_path)
+    return checkpoints[0].get(username) if checkpoints else None
+
+def save_validation_checkpoint(username, checkpoint):
+    checkpoints = load_from_file(validation_checkpoint_path) if os.path.isfile(validation_checkpoint_path) else []
+    checkpoints = dict(checkpoints[0]) if checkpoints else {}
+    checkpoints[username] = checkpoint
+    save_to_file(checkpoints, validation_checkpoint_path)
+
+
 class Blockchain:
     def __init__(self):
         self.chain = [self.create_genesis_block()]
@@ -104,12 +277,11 @@ class Blockchain:
         self._save_block_to_file(block)
 
     def _save_block_to_file(self, block):
-        blocks = load_from_file(blockchain_file_path)
-        if len(blocks) > 0: 
-            blocks.append(block)
+        if len(block_log) > 0:
+            block_log.append(block)
         else:
-            blocks = self.chain
-        save_to_file(blocks, blockchain_file_path)
+            block_log.save(self.chain)
+        balance_index.update()
         save_to_file(self.last_mined_timestamp, last_mined_timestamp_path)
 
     def _load_last_mined_timestamp(self):
@@ -126,12 +298,37 @@ class Blockchain:
     def blockchain_is_valid(self, current_user):
         invalid_blocks = []
         valid_pending_blocks = []
+        updated_heights = []
         # Check for genesis block
         if not self.chain:
             return True
         
         previous_hash = "0"
 
+        # blocks up to the checkpoint passed an earlier run, as long as the block there still hashes
+        # to the checkpoint and the block after it links to that hash
+        first_height = 1
+        checkpoint = load_validation_checkpoint(current_user)
+        if checkpoint is not None and 0 < checkpoint[0] < len(self.chain):
+            checkpoint_height, checkpoint_hash = checkpoint[0], checkpoint[1]
+            checkpoint_block = self.chain[checkpoint_height]
+            if checkpoint_block.compute_hash() == checkpoint_hash and checkpoint_block.has_valid_merkle_root():
+                if checkpoint_height + 1 == len(self.chain) or self.chain[checkpoint_height + 1].previous_hash == checkpoint_hash:
+                    first_height = checkpoint_height + 1
+
+        # pick the blocks to check and verify all their signatures at once, spread over the cores
+        heights_to_check = []
+        for i in range(first_height, len(self.chain)):
+            current_block = self.chain[i]
+            # skip blocks already validated by user
+            if any(current_user == user for user, _ in current_block.validators):
+                continue
+            # skip blocks created by the user
+            if get_username_miner(i) == current_user:
+                continue
+            heights_to_check.append(i)
+        signature_results = dict(zip(heights_to_check, verify_blocks([self.chain[i] for i in heights_to_check])))
+
         # Start with the last block and validate chain integrity
         for i, current_block in enumerate(self.chain):
             # Skip genesis block but check its previous hash
@@ -140,25 +337,14 @@ class Blockchain:
                     print("Genesis block's previous hash should be '0'.")
                     return False
                 previous_hash = current_block.hash
+                if first_height > 1:
+                    # the first new block has to link to the checkpoint
+                    previous_hash = checkpoint_hash
                 continue
 
-            skip_block = False
-            # check if block is already validated by user
-            if current_block.validators:
-                for user, type in current_block.validators:
-                    if current_user == user:
-                        skip_block = True
-                        break
-            
-            if skip_block:
+            if i not in signature_results:
                 continue
 
-            # check if block is created by miner
-            if i != 0:
-                miner_username = get_username_miner(blockchain_file_path, i)
-                if miner_username == current_user:
-                    continue
-
 
             current_hash = current_block.compute_hash()    
 
@@ -169,8 +355,8 @@ class Blockchain:
                 if current_block.id not in invalid_blocks:  
                     invalid_blocks.append(current_block.id)
 
-            # 2. Check the hash of the current block
-            if current_block.hash != current_hash:
+            # 2. Check the hash of the current block, and for Merkle headers the root it covers
+            if current_block.hash != current_hash or not current_block.has_valid_merkle_root():
                 print(f"Hash of the block {i} is not valid.")
                 current_block.validators.append((current_user, "invalid"))  
                 if current_block.id not in invalid_blocks:  
@@ -185,25 +371,40 @@ class Blockchain:
                     invalid_blocks.append(current_block.id)
 
             # 4. Validate all transactions in the block
-            for transaction in current_block.transactions:
-                if not transaction.is_valid():
+            for transaction, signature_valid in zip(current_block.transactions, signature_results[i]):
+                if not transaction.is_valid(signature_valid):
                     print(f"Transaction {transaction} in block {i} is not valid.")
                     current_block.validators.append((current_user, "invalid"))
                     if current_block.id not in invalid_blocks:  
                         invalid_blocks.append(current_block.id)
 
+            if current_block.id in invalid_blocks:
+                updated_heights.append(i)
+
             # if block status is on pending add a valid flag
             if current_block.status == BLOCK_STATUS[0] and current_block.id not in invalid_blocks:
                 current_block.validators.append(current_user, "valid")
                 valid_pending_blocks.append(current_block.id)
+                updated_heights.append(i)
                 
             previous_hash = current_hash
 
+        # move the checkpoint over the verified blocks that passed, pending ones can still change
+        checkpoint_height = first_height - 1
+        for i in range(first_height, len(self.chain)):
+            if self.chain[i].status != BLOCK_STATUS[1] or self.chain[i].id in invalid_blocks:
+                break
+            checkpoint_height = i
+        if checkpoint_height >= first_height:
+            save_validation_checkpoint(current_user, (checkpoint_height, self.chain[checkpoint_height].compute_hash()))
+
         #update ledger
         if invalid_blocks or valid_pending_blocks:
-            save_to_file(self.chain, blockchain_file_path)
-            # update invalid blocks to servers
-            send_data_to_miner_servers((data_type_miner[3], self.chain))
+            # only the blocks from the first flagged one on are written again
+            block_log.save(self.chain, min(updated_heights))
+            # send the new flags to servers, they apply them to their own copy
+            for height in sorted(set(updated_heights)):
+                send_block_flags(height, self.chain[height], current_user)
 
             #check if 3 flags
             check_validators(self.chain, current_user)
@@ -222,23 +423,27 @@ class Blockchain:
             print(f"Too soon to mine again. Please wait {180 - time_since_last_mine:.0f} more seconds.")
             return
         
+        # cleared before the chain is checked, so a block that arrives after the check cancels this mining
+        mining_cancelled.clear()
         # new block can only be mined if every block is valid
-        load_chain = load_from_file(blockchain_file_path)
+        load_chain = block_log.load()
         if load_chain:
             for block in reversed(load_chain):
                 if block.status != BLOCK_STATUS[1] and block.id != 0 and block.previous_hash != "0":
                     print(f"Mining is not possible until the validation of block {block.id} is completed.")
                     return
 
-        transactions = load_from_file(transactions_file_path)
+        # invalid transactions get flagged below, so the pool is a copy of its own
+        transactions = transaction_journal.load(copy=True)
         transactions_to_mine = []
-        indices_to_remove = []
+        ids_to_remove = set()
         # Need to have 5 transactions to mine (4 transactions + mining reward)
         if len(transactions) < 4:
             print("Not enough transactions to mine.")
             return
-        elif len(transactions) >= 10:
-            transactions_list = get_all_transactions(transactions_file_path)
+        mempool = Mempool(transactions)
+        if len(transactions) >= 10:
+            transactions_list = get_all_transactions()
             print("All Transactions: \n")
             for tx in transactions_list:
                 if len(tx) > 6:
@@ -267,13 +472,13 @@ class Blockchain:
                         if not check_if_already_validated:
                             # validate transaction
                             if transactions[index].is_valid():
-                                indices_to_remove.append(index)
+                                ids_to_remove.add(transactions[index].txid())
                                 transactions_to_mine.append(transactions[index])
                             else:
                                 # flag invalid transaction
                                 transactions[index].validators.append((username, "invalid"))
                                 # remove and update the transaction
-                                indices_to_remove.append(index)
+                                ids_to_remove.add(transactions[index].txid())
                                 invalid_tx.append(transactions[index])
                     else:
                         print("Invalid input. Please enter numbers within the range.")
@@ -282,47 +487,31 @@ class Blockchain:
                     print("Invalid input. Please enter numbers only.")
                     return
             # Filter out the user-picked transactions
-            filtered_transactions = [tx for tx in transactions if tx not in transactions_to_mine]
-            for i in range(5):
-                if len(transactions_to_mine) == i:
-                    remaining_slots = 9 - i
-                    break
-
-            sorted_transactions = sorted(filtered_transactions, key=lambda x: x.timestamp)  # Sort by timestamp
-            for tx in sorted_transactions:
-                if remaining_slots > 0:
-                    check_if_already_validated = any(name == username for name, _ in tx.validators)
-                    if not check_if_already_validated:
-                        # validate transation
-                        if tx.is_valid():
-                            transactions_to_mine.append(tx)
-                            indices_to_remove.append(transactions.index(tx))
-                            remaining_slots -= 1
-                        else:
-                            tx.validators.append((username, "invalid"))
-                            indices_to_remove.append(transactions.index(tx)) 
-                            invalid_tx.append(transactions[index])
+            for txid in ids_to_remove:
+                mempool.remove(txid)
+
+        # fill the remaining of the 9 slots with the highest fees first
+        remaining_slots = 9 - len(transactions_to_mine)
+        while remaining_slots > 0 and len(mempool) > 0:
+            txid, tx = mempool.pop_highest_fee()
+            check_if_already_validated = any(name == username for name, _ in tx.validators)
+            if not check_if_already_validated:
+                # validate transation
+                if tx.is_valid():
+                    transactions_to_mine.append(tx)
+                    ids_to_remove.add(txid)
+                    remaining_slots -= 1
                 else:
-                    break
-
-        if transactions_to_mine == []:
-            for tx in transactions:
-                check_if_already_validated = any(name == username for name, _ in tx.validators)
-                if not check_if_already_validated:
-                    if tx.is_valid():
-                        transactions_to_mine.append(tx)
-                        indices_to_remove.append(transactions.index(tx))
-                    else:
-                        tx.validators.append((username, "invalid"))
-                        indices_to_remove.append(transactions.index(tx))
-                        invalid_tx.append(tx)
+                    tx.validators.append((username, "invalid"))
+                    ids_to_remove.add(txid)
+                    invalid_tx.append(tx)
 
         # if all transactions from pool are invalid, there is nothing to mine
-        if transactions_to_mine == [] and indices_to_remove == []:
+        if transactions_to_mine == [] and not ids_to_remove:
             print("There are no valid transactions to mine")
             return
         # if there are invalid transactions found and there is no valid transaction to mine
-        elif transactions_to_mine == [] and indices_to_remove != []: 
+        elif transactions_to_mine == [] and ids_to_remove: 
             # updated invalid transactions
             print("There are no valid transactions to mine")
             return
@@ -332,10 +521,10 @@ class Blockchain:
         else:
             # Add a reward transaction for the miner
             decrypted_private_key = fetch_decrypted_private_key(username)
-            public_key = get_current_user_public_key(username)
+            address = get_current_user_address(username)
             reward_transaction = Transaction(type = REWARD)
             # Since it's a reward, there are no inputs. 
-            reward_transaction.add_output(public_key, REWARD_VALUE)
+            reward_transaction.add_output(address, REWARD_VALUE)
             reward_transaction.sign(decrypted_private_key)
             
             transactions_to_mine.append(reward_transaction)
@@ -365,25 +554,23 @@ class Blockchain:
 
             send_data_to_wallet_servers((data_type_wallet[4], f"new added block with id {new_block.id} waiting for verification", username))
 
-        # removing transactions from main pool
-        for index in sorted(indices_to_remove, reverse=True):
-            remove_from_file(transactions_file_path, index) 
-            
-            
-        # send indices to servers to remove from pool
-        send_data_to_miner_servers((data_type_miner[5], indices_to_remove))
+        # removing transactions from main pool in one journal write
+        transaction_journal.remove(ids_to_remove)
+
+        # send the ids to servers to remove from pool
+        send_data_to_miner_servers((data_type_miner[5], ids_to_remove))
 
         
         # update invalid transactions
         if invalid_tx:
             for tx in invalid_tx:
-                transaction_pool.add_transaction(tx, transactions_file_path) # add to main pool
+                transaction_pool.add_transaction(tx) # add to main pool
                 # send transaction to servers
                 send_data_to_miner_servers((data_type_miner[1], tx))
 
     def view_blockchain(self, username=None):
         print_header(username)
-        chain = load_from_file(blockchain_file_path) 
+        chain = block_log.load()
         if not chain:
             print_header(username)
             print("No blockchain found.")
@@ -391,12 +578,13 @@ class Blockchain:
         else:
             print_header(username)
             print("The entire blockchain: \n")
-            for block in chain:
+            for index, block in enumerate(chain):
                 if block.previous_hash == "0":
                     print(f"Genesis Block created at: {datetime.datetime.fromtimestamp(block.timestamp).strftime('%d-%m-%Y %H:%M:%S')}")
                 else:
-                    block_miner = get_username_miner(blockchain_file_path, chain.index(block))
-                    print(f"{chain.index(block)}. Block mined by {block_miner} at: {datetime.datetime.fromtimestamp(block.timestamp).strftime('%d-%m-%Y %H:%M:%S')} [{block.status}]")
+                    # the miner is the receiver of the reward, the last transaction of the block
+                    block_miner = fetch_username_by_address(block.transactions[-1].output[0])[0][0]
+                    print(f"{index}. Block mined by {block_miner} at: {datetime.datetime.fromtimestamp(block.timestamp).strftime('%d-%m-%Y %H:%M:%S')} [{block.status}]")
 
         print(f"{len(chain)}. Back to main menu\n")
         
@@ -417,18 +605,19 @@ class Blockchain:
             return
         else:
             print_header(username)
-            self._view_block(chain, choice, username)
+            self._view_block(choice, username)
             return
 
-    def _view_block(self, chain, block_index, username=None):
+    def _view_block(self, block_index, username=None):
         options = [
         {"option": "1", "text": "Back to blockchain", "action": lambda: self.view_blockchain(username)},
         {"option": "2", "text": "Back to main menu", "action": lambda: "back"}
         ]
-        transactions = get_all_transactions_in_block(chain, block_index)
-        block_miner = get_username_miner(blockchain_file_path, block_index)
-        validators = chain[block_index].validators
-        transactions_to_display =  f"Block {block_index}: \n\nBlock ID: {chain[block_index].id} \nStatus: {chain[block_index].status}\nMined by {block_miner} at: {datetime.datetime.fromtimestamp(chain[block_index].timestamp).strftime('%d-%m-%Y %H:%M:%S')}\nHash: {chain[block_index].hash}\nNonce: {chain[block_index].nonce}\nDifficulty: {chain[block_index].difficulty}\nPrevious_hash: {chain[block_index].previous_hash}"
+        block = block_log.read(block_index)
+        transactions = get_all_transactions_in_block(block)
+        block_miner = get_username_miner(block_index)
+        validators = block.validators
+        transactions_to_display =  f"Block {block_index}: \n\nBlock ID: {block.id} \nStatus: {block.status}\nMined by {block_miner} at: {datetime.datetime.fromtimestamp(block.timestamp).strftime('%d-%m-%Y %H:%M:%S')}\nHash: {block.hash}\nNonce: {block.nonce}\nDifficulty: {block.difficulty}\nPrevious_hash: {block.previous_hash}"
         if len(validators) > 0:
             for val in validators:
                 transactions_to_display += f"\n🏳️  Flagged {val[1]} by {val[0]}"
@@ -444,10 +633,14 @@ class Blockchain:
         display_menu_and_get_choice(options, username, transactions_to_display)
 
 
+def send_block_flags(height, block, username):
+    # peers add the flags of this validator to their copy of the block instead of receiving the whole chain
+    flags = [flag for flag in block.validators if flag[0] == username]
+    send_data_to_miner_servers((data_type_miner[6], (height, block.hash, flags)))
+
 def check_validators(chain, miner_username):
     invalid_flags = 0
     valid_flags = 0
-    db = Database()
 
     for validator in chain[-1].validators:
         if validator[1] == "valid":
@@ -459,15 +652,15 @@ def check_validators(chain, miner_username):
         for tx in chain[-1].transactions:
             if tx.input != None:            
                 #notify succesful transactions 
-                get_sender_username = db.fetch('SELECT username FROM users WHERE publickey=?', (tx.input[0], ))
-                receiver_username = db.fetch('SELECT username FROM users WHERE publickey=?', (tx.output[0], ))
+                get_sender_username = fetch_username_by_address(tx.input[0])
+                receiver_username = fetch_username_by_address(tx.output[0])
                 notification.add_notification(get_sender_username[0][0], f"successful transaction: {tx.input[1]} coin(s) to {receiver_username[0][0]}")
                 notification.add_notification(receiver_username[0][0], f"successful transaction received: {tx.input[1]} coin(s) from {get_sender_username[0][0]}")
                 send_data_to_wallet_servers((data_type_wallet[3], get_sender_username[0][0], f"successful transaction: {tx.input[1]} coin(s) to {receiver_username[0][0]}"))
                 send_data_to_wallet_servers((data_type_wallet[3], receiver_username[0][0], f"successful transaction received: {tx.input[1]} coin(s) from {get_sender_username[0][0]}"))
             else:
                 #reward notification
-                get_username = db.fetch('SELECT username FROM users WHERE publickey=?', (tx.output[0], ))
+                get_username = fetch_username_by_address(tx.output[0])
                 notification.add_notification(get_username[0][0], f"reward of {tx.output[1]} coin(s) added to you balance")
                 send_data_to_wallet_servers((data_type_wallet[3], get_username[0][0], f"reward of {tx.output[1]} coin(s) added to you balance"))
         
@@ -491,18 +684,19 @@ def check_validators(chain, miner_username):
         list_transactions = chain[-1].transactions
         # put transactions back in pool
         for tx in list_transactions[:-1]: #skips the reward transaction of miner
-            transaction_pool.add_transaction(tx, transactions_file_path)
+            transaction_pool.add_transaction(tx)
             # send transaction to servers
             send_data_to_miner_servers((data_type_miner[1], tx))
 
         # remove block from blockchain
-        remove_from_file(blockchain_file_path, len(chain)-1)
+        block_log.remove(len(chain)-1)
         # send block to servers
         send_data_to_miner_servers((data_type_miner[4], len(chain)-1))
 
         if chain[-1].id == 1:
-            remove_from_file(blockchain_file_path, 0)
+            block_log.remove(0)
             send_data_to_miner_servers((data_type_miner[4], 0))
+        balance_index.update()
 
         #notify user's rejected block
         notification.add_notification(miner_username, f"Your mined block with id {chain[-1].id} is rejected")
@@ -510,6 +704,8 @@ def check_validators(chain, miner_username):
         return
 
     #update ledger
-    save_to_file(chain, blockchain_file_path)
-    send_data_to_miner_servers((data_type_miner[3], chain))
+    block_log.update(len(chain) - 1, chain[-1])
+    balance_index.update()
+    if chain[-1].status == BLOCK_STATUS[1]:
+        send_data_to_miner_servers((data_type_miner[7], (len(chain) - 1, chain[-1].hash, chain[-1].status)))
     return
\ No newline at end of file
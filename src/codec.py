@@ -0,0 +1,215 @@
+import base64
+import functools
+import struct
+from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature, encode_dss_signature
+
+# Field encoders shared by the binary formats of Block and Transaction.
+# Every variable field starts with a tag byte so that values which don't fit the
+# compact fixed-width form still round-trip exactly: hashes and signatures are
+# part of what gets hashed and signed, so a decoded object has to be identical.
+# Stored records put the fields that have a fixed-width form into one struct
+# read in a single unpack, and keep the tagged fields for anything else.
+
+FORMAT_VERSION = 1
+
+TAG_NONE = 0
+TAG_INT = 1
+TAG_FLOAT = 2
+TAG_FIXED = 3 # the compact fixed-width form of the field
+TAG_BYTES = 4
+TAG_STR = 5
+TAG_PEM = 6 # P-384 public key stored as its DER body
+TAG_ADDRESS = 7 # 20 byte account address
+TAG_KEY_REF = 8 # P-384 public key kept once in a key table, stored as its one byte index
+
+NUMBER = struct.Struct("<Bq")
+FLOAT = struct.Struct("<Bd")
+TAG = struct.Struct("<B")
+LENGTH = struct.Struct("<H")
+NO_VALIDATORS = LENGTH.pack(0)
+
+PEM_HEADER = b"-----BEGIN PUBLIC KEY-----\n"
+PEM_FOOTER = b"\n-----END PUBLIC KEY-----\n"
+P384_DER_LENGTH = 120 # SubjectPublicKeyInfo of an uncompressed SECP384R1 point
+P384_SIGNATURE_LENGTH = 96 # r || s, 48 bytes each
+VERDICTS = ["valid", "invalid"]
+MAX_KEY_REFS = 256 # keys a one byte reference can name
+
+
+def pem_to_der(pem):
+    body = pem[len(PEM_HEADER):-len(PEM_FOOTER)].replace(b"\n", b"")
+    return base64.b64decode(body)
+
+def der_to_pem(der):
+    body = base64.b64encode(der)
+    lines = [body[i:i + 64] for i in range(0, len(body), 64)]
+    return PEM_HEADER + b"\n".join(lines) + PEM_FOOTER
+
+
+@functools.lru_cache(maxsize=1024)
+def cached_pem(der):
+    # legacy transactions keep naming the same few keys, so they are rebuilt once
+    return der_to_pem(der)
+
+
+class Reader:
+    def __init__(self, data, offset=0):
+        self.data = data
+        self.offset = offset
+
+    def unpack(self, fmt):
+        values = fmt.unpack_from(self.data, self.offset)
+        self.offset += fmt.size
+        return values
+
+    def take(self, length):
+        chunk = bytes(self.data[self.offset:self.offset + length])
+        self.offset += length
+        return chunk
+
+    def tag(self):
+        return self.unpack(TAG)[0]
+
+    def blob(self):
+        return self.take(self.unpack(LENGTH)[0])
+
+
+def encode_blob(data):
+    return LENGTH.pack(len(data)) + data
+
+def encode_number(value):
+    # ints and floats are kept apart, str(50) and str(50.0) hash differently
+    if value is None:
+        return NUMBER.pack(TAG_NONE, 0)
+    if isinstance(value, int):
+        return NUMBER.pack(TAG_INT, value)
+    return FLOAT.pack(TAG_FLOAT, value)
+
+def decode_number(reader):
+    tag = reader.data[reader.offset]
+    if tag == TAG_FLOAT:
+        return reader.unpack(FLOAT)[1]
+    value = reader.unpack(NUMBER)[1]
+    return None if tag == TAG_NONE else value
+
+def encode_text(value):
+    # short strings such as usernames, block hashes and the genesis previous hash
+    if value is None:
+        return TAG.pack(TAG_NONE)
+    if isinstance(value, bytes):
+        return TAG.pack(TAG_BYTES) + encode_blob(value)
+    if len(value) == 64:
+        try:
+            raw = bytes.fromhex(value)
+            if raw.hex() == value:
+                return TAG.pack(TAG_FIXED) + raw
+        except ValueError:
+            pass
+    return TAG.pack(TAG_STR) + encode_blob(value.encode("utf-8"))
+
+def decode_text(reader):
+    tag = reader.tag()
+    if tag == TAG_NONE:
+        return None
+    if tag == TAG_FIXED:
+        return reader.take(32).hex()
+    if tag == TAG_BYTES:
+        return reader.blob()
+    return reader.blob().decode("utf-8")
+
+def pack_address(address):
+    # (tag, raw bytes) of an address with a fixed-width form, None for anything else:
+    # a PEM public key is stored as its 120 byte DER body and rebuilt on decode,
+    # a hex address as its 20 raw bytes
+    if isinstance(address, bytes) and address.startswith(PEM_HEADER) and address.endswith(PEM_FOOTER):
+        try:
+            der = pem_to_der(address)
+            if len(der) == P384_DER_LENGTH and der_to_pem(der) == address:
+                return TAG_PEM, der
+        except ValueError:
+            pass
+    if isinstance(address, str) and len(address) == 40:
+        try:
+            raw = bytes.fromhex(address)
+            if raw.hex() == address:
+                return TAG_ADDRESS, raw
+        except ValueError:
+            pass
+    return None
+
+def read_address(data, offset, tag, keys=None):
+    # (address, offset after it) of an address packed by pack_address or a reference into the key table `keys`
+    if tag == TAG_ADDRESS:
+        return data[offset:offset + 20].hex(), offset + 20
+    if tag == TAG_KEY_REF:
+        return keys[data[offset]], offset + 1
+    if tag == TAG_PEM:
+        return cached_pem(data[offset:offset + P384_DER_LENGTH]), offset + P384_DER_LENGTH
+    raise ValueError(f"Unknown address tag {tag}")
+
+def encode_address(address):
+    packed = pack_address(address)
+    if packed is None:
+        return encode_text(address)
+    return TAG.pack(packed[0]) + packed[1]
+
+def decode_address(reader):
+    if reader.data[reader.offset] == TAG_PEM:
+        reader.offset += TAG.size
+        return cached_pem(reader.take(P384_DER_LENGTH))
+    if reader.data[reader.offset] == TAG_ADDRESS:
+        reader.offset += TAG.size
+        return reader.take(20).hex()
+    return decode_text(reader)
+
+def encode_signature(signature):
+    # DER is canonical, so the fixed-width r || s form gives back the exact same bytes
+    if signature is None:
+        return TAG.pack(TAG_NONE)
+    try:
+        r, s = decode_dss_signature(signature)
+        if r.bit_length() <= 384 and s.bit_length() <= 384 and encode_dss_signature(r, s) == signature:
+            return TAG.pack(TAG_FIXED) + r.to_bytes(48, "big") + s.to_bytes(48, "big")
+    except ValueError:
+        pass
+    return TAG.pack(TAG_BYTES) + encode_blob(signature)
+
+def decode_signature(reader):
+    tag = reader.tag()
+    if tag == TAG_NONE:
+        return None
+    if tag == TAG_FIXED:
+        raw = reader.take(P384_SIGNATURE_LENGTH)
+        return encode_dss_signature(int.from_bytes(raw[:48], "big"), int.from_bytes(raw[48:], "big"))
+    return reader.blob()
+
+def fixed_hash(value):
+    # the 32 raw bytes of a sha256 hex digest, None for anything else
+    if isinstance(value, str) and len(value) == 64:
+        try:
+            raw = bytes.fromhex(value)
+            if raw.hex() == value:
+                return raw
+        except ValueError:
+            pass
+    return None
+
+def is_exact_double(value):
+    # amounts of the fixed-width layout are doubles, ints that a double can't hold keep the tagged form
+    return type(value) is float or (type(value) is int and -2 ** 53 <= value <= 2 ** 53)
+
+def encode_validators(validators):
+    data = LENGTH.pack(len(validators))
+    for name, verdict in validators:
+        data += encode_text(name) + TAG.pack(VERDICTS.index(verdict))
+    return data
+
+def decode_validators(reader):
+    if reader.data[reader.offset:reader.offset + LENGTH.size] == NO_VALIDATORS:
+        reader.offset += LENGTH.size
+        return []
+    validators = []
+    for _ in range(reader.unpack(LENGTH)[0]):
+        name = decode_text(reader)
+        validators.append((name, VERDICTS[reader.tag()]))
+    return validators
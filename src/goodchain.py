@@ -6,6 +6,7 @@ from notifications import notification
 from block_validation import validation_chain
 from miner_server import handle_miner_termination_server, start_miner_server
 from wallet_server import handle_wallet_termination_server, start_wallet_server
+from peers import peer_connections
 from transaction import Transaction
 from recover_key import recover_private_key
 from utils import clear_screen, print_header, display_menu_and_get_choice
@@ -58,14 +59,18 @@ def main_menu():
         options = display_menu(user.current_user is not None) # Assuming that user.current_user is None when not logged in
         choice_result = display_menu_and_get_choice(options, user.current_user)
         if choice_result == "exit":
+            # waits for the last acknowledgements while this node's servers still answer the others
+            peer_connections.close()
             handle_miner_termination_server()
             handle_wallet_termination_server()
             clear_screen()
             break     
 
-db.setup()
-server_thread = threading.Thread(target=start_miner_server)
-server_thread.start()
-wallet_server_thread = threading.Thread(target=start_wallet_server)
-wallet_server_thread.start()
-main_menu()
\ No newline at end of file
+# the spawned mining and verification workers import this module without starting the node
+if __name__ == "__main__":
+    db.setup()
+    server_thread = threading.Thread(target=start_miner_server)
+    server_thread.start()
+    wallet_server_thread = threading.Thread(target=start_wallet_server)
+    wallet_server_thread.start()
+    main_menu()
\ No newline at end of file
@@ -1,5 +1,6 @@
 import os
 import sqlite3
+import threading
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import ec
 from database import Database
@@ -87,6 +88,21 @@ def view_user_keys(username):
         return
 
 def fetch_decrypted_private_key(username):
+    """
+    Returns the private key for the given username, from the session when that user is logged in.
+    
+    Parameters:
+    - username (str): The username for which the private key should be fetched.
+    
+    Returns:
+    - str: Decrypted private key for the provided username.
+    """
+    private_key = session_key.get(username)
+    if private_key is not None:
+        return private_key
+    return load_decrypted_private_key(username)
+
+def load_decrypted_private_key(username):
     """
     Fetches and decrypts the private key for the given username from the database.
     
@@ -123,6 +139,38 @@ def fetch_decrypted_private_key(username):
 
     return serialised_private_key
 
+class SessionKey:
+    """Decrypted private key of the logged in user, loaded once at login and dropped at logout."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.username = None
+        self.private_key = None
+
+    def open(self, username):
+        private_key = load_decrypted_private_key(username)
+        with self.lock:
+            self.username = username
+            self.private_key = private_key
+
+    def close(self):
+        with self.lock:
+            self.username = None
+            self.private_key = None
+
+    def rename(self, username, new_username):
+        with self.lock:
+            if self.username == username:
+                self.username = new_username
+
+    def get(self, username):
+        with self.lock:
+            if username is not None and username == self.username:
+                return self.private_key
+            return None
+
+session_key = SessionKey()
+
 # generate a key to encrypt
 def generate_key() : return Fernet.generate_key()
 
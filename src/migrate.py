@@ -0,0 +1,60 @@
+import os
+import shutil
+# imported first so that unpickling old records doesn't import them halfway through storage
+from blockchain import Block
+from transaction import Transaction
+from storage import BlockLog, block_log, transaction_journal, blocks_folder, blockchain_file_path, transactions_file_path, transactions_journal_path
+
+# One-shot rewrite of the ledger files into the compact Block/Transaction format.
+# Opening the block log and the journal imports the old blockchain.dat and
+# transactions.dat pickles; everything loaded is then written back, so records
+# that are still pickles end up as binary records in the current format.
+# The blocks are written to a new folder that replaces the old one only once it
+# is complete, and the old folder is kept as blocks.bak.
+
+def size_of(*paths):
+    total = 0
+    for path in paths:
+        if os.path.isdir(path):
+            total += sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+        elif os.path.isfile(path):
+            total += os.path.getsize(path)
+    return total
+
+def restore_interrupted_swap(backup_folder):
+    # a crash between the two renames leaves only the backup
+    if not os.path.exists(blocks_folder) and os.path.isdir(backup_folder):
+        os.replace(backup_folder, blocks_folder)
+
+def save_blocks(chain):
+    backup_folder = blocks_folder + ".bak"
+    temp_folder = blocks_folder + ".tmp"
+    if os.path.isdir(temp_folder):
+        shutil.rmtree(temp_folder)
+    temp_log = BlockLog(temp_folder)
+    temp_log.save(chain)
+    temp_log.close()
+
+    block_log.close()
+    if os.path.isdir(backup_folder):
+        shutil.rmtree(backup_folder)
+    os.replace(blocks_folder, backup_folder)
+    os.replace(temp_folder, blocks_folder)
+
+def migrate_ledger():
+    restore_interrupted_swap(blocks_folder + ".bak")
+    blocks_before = size_of(blocks_folder, blockchain_file_path)
+    pool_before = size_of(transactions_journal_path, transactions_file_path)
+    chain = block_log.load()
+    pool = transaction_journal.load()
+
+    save_blocks(chain)
+    transaction_journal.compact()
+
+    blocks_after = size_of(blocks_folder)
+    pool_after = size_of(transactions_journal_path)
+    print(f"Blockchain: {len(chain)} blocks, {blocks_before} -> {blocks_after} bytes")
+    print(f"Transaction pool: {len(pool)} transactions, {pool_before} -> {pool_after} bytes")
+
+if __name__ == "__main__":
+    migrate_ledger()
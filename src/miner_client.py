@@ -1,7 +1,7 @@
-import pickle
-import socket
+from protocol import MESSAGE_MINER
+from peers import peer_connections
 
-data_type_miner = ["add block", "add transaction", "remove transaction", "block validation", "remove block", "remove transaction list"]
+data_type_miner = ["add block", "add transaction", "remove transaction", "block validation", "remove block", "remove transaction list", "flag block", "block status"]
 miner_server_port = 9000
          
 def send_data_to_miner_servers(data):
@@ -9,14 +9,5 @@ def send_data_to_miner_servers(data):
 
     server_address = (server_ip, miner_server_port)
 
-    try:
-        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client.connect(server_address)
-        
-        # Serialize the data
-        serialized_data = pickle.dumps(data)
-        client.sendall(serialized_data)
-        
-        client.close()
-    except ConnectionRefusedError:
-        exit()
+    # framed onto the connection kept open to the server, queued while the server is down
+    peer_connections.send(server_address, MESSAGE_MINER, data)
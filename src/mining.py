@@ -0,0 +1,99 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+
+# Proof of work spread over a pool of worker processes.
+# The workers take batches of nonces from a shared counter, so the nonce space is
+# split between them without overlap, and the first one to find a hash with enough
+# leading zeroes sets the shared event that stops the others. The pool is started
+# on the first search and kept for the next ones, its workers are spawned rather
+# than forked so they don't inherit the server threads and sockets of the node.
+
+MINING_WORKERS = os.cpu_count() or 1
+NONCE_BATCH = 20000 # nonces a worker claims from the shared counter at a time
+POLL_INTERVAL = 0.1 # seconds between checks whether mining should be given up
+WORKER_CONTEXT = multiprocessing.get_context("spawn") # also used by the verification pool
+
+# set by the miner server when another node's block arrives, the search in
+# progress is then abandoned at the end of the workers' current batch
+mining_cancelled = threading.Event()
+
+_counter = None
+_found = None
+
+_pool_lock = threading.Lock() # one search at a time uses the pool
+_pool = None # (pool, workers, counter, found)
+
+def _init_worker(counter, found):
+    global _counter, _found
+    _counter = counter
+    _found = found
+
+def _search(job):
+    # returns the nonce found, or None when stopped, and the number of hashes computed
+    prefix, difficulty = job
+    # the prefix is fed once, every nonce continues from a copy of that state
+    midstate = hashlib.sha256(prefix)
+    # difficulty counts hex digits, so an odd one ends on the high nibble of a byte
+    zero_bytes, odd = divmod(difficulty, 2)
+    zeroes = bytes(zero_bytes)
+    hashes_done = 0
+    while not _found.is_set():
+        with _counter.get_lock():
+            start = _counter.value
+            _counter.value += NONCE_BATCH
+        for nonce in range(start, start + NONCE_BATCH):
+            sha = midstate.copy()
+            sha.update(b'%d' % nonce)
+            digest = sha.digest()
+            if digest[:zero_bytes] == zeroes and (not odd or digest[zero_bytes] < 16):
+                _found.set()
+                return nonce, hashes_done + nonce - start + 1
+        hashes_done += NONCE_BATCH
+    return None, hashes_done
+
+def _mining_pool(workers):
+    global _pool
+    if _pool is None or _pool[1] != workers:
+        _close_pool()
+        counter = WORKER_CONTEXT.Value('Q', 0)
+        found = WORKER_CONTEXT.Event()
+        pool = WORKER_CONTEXT.Pool(workers, initializer=_init_worker, initargs=(counter, found))
+        _pool = (pool, workers, counter, found)
+    return _pool
+
+def _close_pool():
+    global _pool
+    if _pool is not None:
+        _pool[0].terminate()
+        _pool = None
+
+def find_nonce(prefix, difficulty, start_nonce=0, should_stop=None, workers=MINING_WORKERS):
+    # prefix is everything Block.compute_hash hashes in front of the nonce
+    with _pool_lock:
+        pool, _, counter, found = _mining_pool(workers)
+        # every worker of the last search has returned, so the shared state can be reset
+        counter.value = start_nonce
+        found.clear()
+        nonce = None
+        hashes_done = 0
+        try:
+            results = pool.imap_unordered(_search, [(prefix, difficulty)] * workers)
+            finished = 0
+            while finished < workers:
+                try:
+                    worker_nonce, worker_hashes = results.next(POLL_INTERVAL)
+                except multiprocessing.TimeoutError:
+                    if should_stop is not None and should_stop():
+                        found.set()
+                    continue
+                finished += 1
+                hashes_done += worker_hashes
+                if nonce is None:
+                    nonce = worker_nonce
+        except BaseException:
+            # workers still searching would run into the next search, start over with a new pool
+            _close_pool()
+            raise
+    return nonce, hashes_done
@@ -0,0 +1,203 @@
+import asyncio
+import pickle
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from protocol import read_frame, encode_ack, ProtocolError, MESSAGE_HELLO
+
+# Event loop serving the peer connections of the miner and wallet servers.
+# All connections are read by one asyncio loop in the server's thread, so an
+# idle peer costs a socket and a coroutine instead of a thread. The messages of
+# a connection are handled one after the other, each on a fixed pool of worker
+# threads because handlers read and write the ledger files. At most
+# workers + queue depth messages are handed to the pool at a time; a connection
+# whose message finds no slot stops being read until one frees up, which slows
+# its sender down without dropping anything it already sent. A message whose
+# handler fails is logged and the connection goes on with the next one, only a
+# malformed frame closes it. Connections beyond MAX_CONNECTIONS are closed as
+# soon as they are accepted.
+#
+# Every message is acknowledged once handled. The last number handled is kept
+# per sender session, so the messages a sender resends after reconnecting are
+# acknowledged again without being handled twice.
+
+SERVER_WORKERS = 8 # threads running message handlers per server
+SERVER_QUEUE_DEPTH = 32 # messages allowed to wait for a worker
+ACCEPT_BACKLOG = 64 # connections the kernel queues before accept
+ADMIT_TIMEOUT = 2.0 # seconds a message waits for a slot before the server reports being busy
+MAX_CONNECTIONS = 4096 # open peer connections per server
+MAX_SESSIONS = 1024 # sender sessions whose last handled message is remembered
+
+class MessageMetrics:
+    """
+    Count and handling time of the messages a server received, per message type.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_type = {} # message type -> [count, total seconds, max seconds]
+
+    def record(self, message_type, seconds):
+        with self.lock:
+            entry = self.by_type.setdefault(message_type, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    def stats(self):
+        with self.lock:
+            return {message_type: {"count": count, "average": total / count, "max": longest}
+                    for message_type, (count, total, longest) in self.by_type.items()}
+
+class NodeServer:
+    """
+    asyncio server for one kind of framed message.
+
+    handle_message(data) is called on a worker thread with the unpickled payload
+    of every message and returns the name of its message type for the metrics.
+    serve() blocks the calling thread until stop() is called from any thread.
+    """
+
+    def __init__(self, name, host, port, message_type, handle_message, workers=SERVER_WORKERS, queue_depth=SERVER_QUEUE_DEPTH):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.message_type = message_type
+        self.handle_message = handle_message
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.metrics = MessageMetrics()
+        self.lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = 0
+        self.delayed = 0
+        self.failed = 0
+        self.loop = None
+        self.stopping = None
+        self.stop_requested = False
+        self.connections = {} # connection task -> stream writer
+        self.sessions = OrderedDict() # session id -> last sequence number handled
+
+    def serve(self):
+        try:
+            asyncio.run(self._serve())
+        except OSError as e:
+            print(f"Error setting up the {self.name} server: {e}")
+
+    def stop(self):
+        with self.lock:
+            self.stop_requested = True
+            if self.loop is not None:
+                try:
+                    self.loop.call_soon_threadsafe(self.stopping.set)
+                except RuntimeError:
+                    # the loop closed already
+                    pass
+
+    async def _serve(self):
+        executor = ThreadPoolExecutor(self.workers, thread_name_prefix=f"{self.name}-server")
+        slots = asyncio.Semaphore(self.workers + self.queue_depth)
+        server = await asyncio.start_server(lambda reader, writer: self._handle(reader, writer, executor, slots),
+                                            self.host, self.port, backlog=ACCEPT_BACKLOG)
+        with self.lock:
+            self.loop = asyncio.get_running_loop()
+            self.stopping = asyncio.Event()
+            if self.stop_requested:
+                self.stopping.set()
+        try:
+            await self.stopping.wait()
+
+            # stop accepting and drop the open connections, handlers already running finish on their own
+            server.close()
+            tasks = list(self.connections)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await server.wait_closed()
+            executor.shutdown(wait=False)
+        finally:
+            with self.lock:
+                self.loop = None
+
+    async def _handle(self, reader, writer, executor, slots):
+        addr = writer.get_extra_info("peername")
+        if len(self.connections) >= MAX_CONNECTIONS:
+            with self.lock:
+                self.rejected += 1
+            print(f"{self.name} server has too many connections, closed connection from {addr}")
+            writer.close()
+            return
+        self.connections[asyncio.current_task()] = writer
+        with self.lock:
+            self.accepted += 1
+        session = None
+        try:
+            while True:
+                frame = await read_frame(reader, (self.message_type, MESSAGE_HELLO))
+                if frame is None:
+                    break
+                message_type, seq, payload = frame
+                if message_type == MESSAGE_HELLO:
+                    session = pickle.loads(payload)
+                    continue
+                if session is not None and seq <= self.sessions.get(session, 0):
+                    # resent after a reconnect, but handled already
+                    writer.write(encode_ack(seq))
+                    await writer.drain()
+                    continue
+                if session is not None:
+                    # claimed before handling, so a copy arriving on the sender's next connection is skipped
+                    self.sessions[session] = seq
+                    self.sessions.move_to_end(session)
+                    if len(self.sessions) > MAX_SESSIONS:
+                        self.sessions.popitem(last=False)
+                try:
+                    await asyncio.wait_for(slots.acquire(), ADMIT_TIMEOUT)
+                except asyncio.TimeoutError:
+                    with self.lock:
+                        self.delayed += 1
+                    print(f"{self.name} server busy, waiting to handle a message from {addr}")
+                    await slots.acquire()
+                try:
+                    await asyncio.get_running_loop().run_in_executor(executor, self._run, payload)
+                except pickle.UnpicklingError:
+                    raise
+                except Exception as e:
+                    # the messages after it on the connection are still handled
+                    with self.lock:
+                        self.failed += 1
+                    print(f"Error handling message from {addr}: {e}")
+                finally:
+                    slots.release()
+                # a message whose handler failed is acknowledged too, sending it again would fail the same way
+                writer.write(encode_ack(seq))
+                await writer.drain()
+        except asyncio.CancelledError:
+            # the server is stopping
+            pass
+        except ConnectionError:
+            # the peer went away, it resends what was not acknowledged
+            pass
+        except (pickle.UnpicklingError, ProtocolError) as e:
+            print(f"Error data from {addr}: {e}")
+        except Exception as e:
+            print(f"Error handling client {addr}: {e}")
+        finally:
+            self.connections.pop(asyncio.current_task(), None)
+            writer.close()
+
+    def _run(self, payload):
+        # unpickling a chain takes a while too, so it is done here rather than on the loop
+        started = time.perf_counter()
+        data = pickle.loads(payload)
+        try:
+            message_type = self.handle_message(data)
+        except SystemExit:
+            # a handler that calls exit() must not take the server down with it
+            raise RuntimeError("handler called exit()")
+        self.metrics.record(message_type, time.perf_counter() - started)
+
+    def stats(self):
+        with self.lock:
+            return {"accepted": self.accepted, "rejected": self.rejected, "delayed": self.delayed, "failed": self.failed, "messages": self.metrics.stats()}
@@ -0,0 +1,177 @@
+import os
+import select
+import socket
+import threading
+import time
+from collections import deque
+from protocol import encode_frame, decode_header, ProtocolError, FRAME_HEADER, MESSAGE_HELLO, MESSAGE_ACK
+
+# Long-lived connections to the peer servers.
+# Every peer address keeps one framed connection that all senders share, so a
+# broadcast costs a write per message instead of a TCP handshake per message.
+# Messages are written one after the other without waiting on the peer, and
+# each stays queued until the peer acknowledges it. When the connection breaks,
+# the next send reconnects and writes the unacknowledged messages again before
+# its own; the peer recognises the ones it already handled by their session and
+# sequence number. A peer that is down doesn't fail the send, its messages wait
+# in the queue, and it is only tried again after a growing pause.
+#
+# What can still be lost: the queue holds at most MAX_UNACKED messages per
+# peer, beyond that the oldest is dropped once ACK_TIMEOUT passes without an
+# acknowledgement, and messages still queued when the process exits or the
+# peer restarts before acknowledging them are not sent again.
+
+CONNECT_TIMEOUT = 5.0 # seconds to wait for a peer to accept the connection
+BACKOFF_BASE = 0.5 # seconds before the first reconnect to a peer that failed
+BACKOFF_MAX = 30.0 # longest pause between reconnects
+MAX_UNACKED = 1000 # messages kept for resending per peer
+ACK_TIMEOUT = 5.0 # seconds to wait for acknowledgements when the queue is full
+CLOSE_TIMEOUT = 2.0 # seconds close() waits for the last acknowledgements
+
+class PeerConnection:
+    """
+    One persistent connection to a peer server, reopened on demand.
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self.lock = threading.Lock()
+        self.sock = None
+        self.failures = 0
+        self.retry_at = 0.0
+        self.session = os.urandom(8).hex()
+        self.next_seq = 1
+        self.unacked = deque() # (sequence number, frame) not acknowledged yet
+        self.sent_seq = 0 # last sequence number written on the current connection
+        self.replies = bytearray()
+
+    def send(self, message_type, data):
+        # returns once the message is queued, while the peer is down it goes out with a later send
+        with self.lock:
+            frame = encode_frame(message_type, data, self.next_seq)
+            if len(self.unacked) >= MAX_UNACKED:
+                self._make_room()
+            self.unacked.append((self.next_seq, frame))
+            self.next_seq += 1
+            self._flush()
+
+    def _flush(self):
+        # writes what the peer hasn't seen yet, returns False when it can't be reached;
+        # a connection that broke since the last send gets one fresh connection
+        for attempt in range(2):
+            if not self._connect():
+                return False
+            try:
+                self._read_acks(0)
+                frames = [frame for seq, frame in self.unacked if seq > self.sent_seq]
+                if frames:
+                    self.sock.sendall(b"".join(frames))
+                    self.sent_seq = self.unacked[-1][0]
+                return True
+            except (OSError, ProtocolError):
+                self._close()
+        self._failed()
+        print(f"Could not send to {self.address}, {len(self.unacked)} message(s) queued for resending")
+        return False
+
+    def _make_room(self):
+        deadline = time.monotonic() + ACK_TIMEOUT
+        while len(self.unacked) >= MAX_UNACKED and self.sock is not None and time.monotonic() < deadline:
+            try:
+                self._read_acks(deadline - time.monotonic())
+            except (OSError, ProtocolError):
+                self._close()
+        while len(self.unacked) >= MAX_UNACKED:
+            seq, _ = self.unacked.popleft()
+            print(f"Message {seq} to {self.address} dropped, it was never acknowledged")
+
+    def _read_acks(self, timeout):
+        # takes the acknowledgements that arrived, waiting at most `timeout` seconds for the first
+        while select.select([self.sock], [], [], timeout)[0]:
+            data = self.sock.recv(65536)
+            if not data:
+                raise ConnectionResetError(f"{self.address} closed the connection")
+            self.replies += data
+            timeout = 0
+        while len(self.replies) >= FRAME_HEADER.size:
+            message_type, seq, length = decode_header(bytes(self.replies[:FRAME_HEADER.size]))
+            if message_type != MESSAGE_ACK or length:
+                raise ProtocolError(f"unexpected message type {message_type} from {self.address}")
+            del self.replies[:FRAME_HEADER.size]
+            while self.unacked and self.unacked[0][0] <= seq:
+                self.unacked.popleft()
+
+    def _connect(self):
+        # returns False while waiting out the pause after a failure and when the peer refuses
+        if self.sock is not None:
+            return True
+        if time.monotonic() < self.retry_at:
+            return False
+        try:
+            self.sock = socket.create_connection(self.address, timeout=CONNECT_TIMEOUT)
+            self.sock.settimeout(None)
+            self.sock.sendall(encode_frame(MESSAGE_HELLO, self.session))
+        except OSError:
+            self._close()
+            self._failed()
+            print(f"Could not connect to {self.address}, {len(self.unacked)} message(s) queued for resending")
+            return False
+        self.failures = 0
+        self.retry_at = 0.0
+        # everything still unacknowledged is written again on the new connection
+        self.sent_seq = 0
+        self.replies = bytearray()
+        return True
+
+    def _failed(self):
+        self.failures += 1
+        self.retry_at = time.monotonic() + min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (self.failures - 1))
+
+    def _close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def close(self, timeout=CLOSE_TIMEOUT):
+        # makes one last try to send what is queued, then gives the peer a moment to acknowledge it
+        with self.lock:
+            if self.unacked:
+                self.retry_at = 0.0
+                self._flush()
+            deadline = time.monotonic() + timeout
+            while self.unacked and self.sock is not None and time.monotonic() < deadline:
+                try:
+                    self._read_acks(deadline - time.monotonic())
+                except (OSError, ProtocolError):
+                    break
+            self._close()
+
+class PeerConnections:
+    """
+    The connection of every peer address the node has sent to.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.peers = {}
+
+    def get(self, address):
+        with self.lock:
+            peer = self.peers.get(address)
+            if peer is None:
+                peer = self.peers[address] = PeerConnection(address)
+            return peer
+
+    def send(self, address, message_type, data):
+        self.get(address).send(message_type, data)
+
+    def close(self):
+        with self.lock:
+            peers = list(self.peers.values())
+        for peer in peers:
+            peer.close()
+
+peer_connections = PeerConnections()
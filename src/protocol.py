@@ -0,0 +1,67 @@
+import asyncio
+import pickle
+from struct import Struct
+
+# Framing of the messages between nodes.
+# Every message is a header (magic, protocol version, message type, payload
+# length) followed by the pickled payload. The reader takes the header first
+# and then exactly the announced number of bytes, so a message of any size up
+# to MAX_FRAME_SIZE arrives whole however the stream splits it, and several
+# messages can follow each other on one connection.
+#
+# A sender opens a connection with a hello frame naming its session and numbers
+# its messages within that session. The server acknowledges every message it
+# handled with an ack frame carrying that number, so after a reconnect the
+# sender resends only what was not acknowledged, and the server skips numbers
+# of the session it already handled.
+
+MAGIC = b"GC"
+PROTOCOL_VERSION = 2
+FRAME_HEADER = Struct("!2sBBII") # magic, version, message type, sequence number, payload length
+
+# message types, the payload of the first two is the data tuple of the matching client
+MESSAGE_MINER = 1
+MESSAGE_WALLET = 2
+MESSAGE_HELLO = 3 # payload is the sender's session id
+MESSAGE_ACK = 4 # no payload, the sequence number is the last message handled
+
+MAX_FRAME_SIZE = 64 * 1024 * 1024 # largest payload accepted, a full chain included
+
+class ProtocolError(Exception):
+    pass
+
+def encode_frame(message_type, data, seq=0):
+    payload = pickle.dumps(data)
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ProtocolError(f"message of {len(payload)} bytes is larger than {MAX_FRAME_SIZE}")
+    return FRAME_HEADER.pack(MAGIC, PROTOCOL_VERSION, message_type, seq, len(payload)) + payload
+
+def encode_ack(seq):
+    return FRAME_HEADER.pack(MAGIC, PROTOCOL_VERSION, MESSAGE_ACK, seq, 0)
+
+def decode_header(header):
+    magic, version, message_type, seq, length = FRAME_HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ProtocolError("not a goodchain message")
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"unsupported protocol version {version}")
+    if length > MAX_FRAME_SIZE:
+        raise ProtocolError(f"message of {length} bytes is larger than {MAX_FRAME_SIZE}")
+    return message_type, seq, length
+
+async def read_frame(reader, expected_types=None):
+    # returns (message type, sequence number, payload bytes), or None when the peer closed the connection between messages
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise ProtocolError(f"connection closed after {len(e.partial)} of {FRAME_HEADER.size} bytes")
+    message_type, seq, length = decode_header(header)
+    if expected_types is not None and message_type not in expected_types:
+        raise ProtocolError(f"unexpected message type {message_type}")
+    try:
+        payload = await reader.readexactly(length)
+    except asyncio.IncompleteReadError as e:
+        raise ProtocolError(f"connection closed after {len(e.partial)} of {length} bytes")
+    return message_type, seq, payload
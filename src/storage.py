@@ -1,23 +1,132 @@
+import mmap
 import os
 import pickle
+import struct
+import threading
+import zlib
+from codec import cached_pem
 
 
 data_folder = "data"
-blockchain_file_path = os.path.join(data_folder, 'blockchain.dat')
-transactions_file_path = os.path.join(data_folder, 'transactions.dat')
+blockchain_file_path = os.path.join(data_folder, 'blockchain.dat') # legacy single-pickle ledger, imported into the block log
+transactions_file_path = os.path.join(data_folder, 'transactions.dat') # legacy single-pickle pool, imported into the journal
+transactions_journal_path = os.path.join(data_folder, 'transactions.log')
 last_mined_timestamp_path = os.path.join(data_folder, "last_mined_timestamp.dat")
+blocks_folder = os.path.join(data_folder, "blocks")
+balances_file_path = os.path.join(data_folder, "balances.log")
+validation_checkpoint_path = os.path.join(data_folder, "validation_checkpoint.dat")
 
 node_data = "node_data"
 
+SEGMENT_SIZE = 4 * 1024 * 1024 # a new segment file is started once the current one grows past this
+RECORD_HEADER = struct.Struct("<II") # payload length, crc32 of payload
+INDEX_ENTRY = struct.Struct("<IQI") # segment number, offset of the record, payload length
+HASH_ENTRY_SIZE = 32 # raw sha256 of the block at that height, zeroes when it has none
+JOURNAL_ADD = "add"
+JOURNAL_REMOVE = "remove"
+JOURNAL_REMOVE_IDS = "remove ids"
+COMPACT_MIN_DEAD = 64 # tombstoned adds tolerated before the journal is compacted
+JOURNAL_RECORD_ADD = 1
+JOURNAL_RECORD_REMOVE_IDS = 2 # followed by the raw 32 byte ids
+JOURNAL_ADD_HEADER = struct.Struct("<BQ") # record kind, sequence number, followed by the transaction
+RECORD_BLOCK = "block"
+RECORD_TRANSACTION = "transaction"
+PICKLE_PROTO = b"\x80" # first byte of a pickle, the form records had before the binary formats
+
+# Block and Transaction are defined in modules that import this one, so they
+# register their binary encoders here: record kind -> (encode(value, keys), decode(payload, keys)),
+# keys being the block log's key table or None
+record_codecs = {}
+
+def register_codec(kind, encode, decode):
+    record_codecs[kind] = (encode, decode)
+
+def encode_value(kind, value, keys=None):
+    codec = record_codecs.get(kind)
+    return codec[0](value, keys) if codec is not None else pickle.dumps(value)
+
+def decode_value(kind, payload, keys=None):
+    if payload[:1] == PICKLE_PROTO or kind not in record_codecs:
+        return pickle.loads(payload)
+    return record_codecs[kind][1](payload, keys)
+
+def file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+class LedgerCache:
+    """
+    Process-wide cache of decoded ledger files, keyed by file path.
+
+    Each entry remembers the inode, size and mtime of its file, so a repeat load
+    of an unchanged file costs one stat and no reading or replaying. Every write
+    in this module invalidates its key, which covers the CLI as well as the miner
+    server thread, and a generation counter keeps a load that raced with a write
+    from storing stale data. Changes made by another process show up through
+    the file stamp.
+
+    Loads hand out the cached objects themselves, so they are shared by every
+    caller and must not be changed. The few callers that change blocks or
+    transactions without writing them back read their own copy with
+    load(copy=True) on the block log or the journal.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.generations = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, key, loader):
+        stamp = file_stamp(key)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and stamp is not None and entry[0] == stamp:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self.generations.get(key, 0)
+
+        data = loader()
+        with self.lock:
+            if stamp is not None and self.generations.get(key, 0) == generation:
+                self.entries[key] = (stamp, data)
+        return data
+
+    def version(self, key):
+        # changes on every write to the file, whether it is made here or by another process
+        with self.lock:
+            return (file_stamp(key), self.generations.get(key, 0))
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.generations[key] = self.generations.get(key, 0) + 1
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+ledger_cache = LedgerCache()
+
 def save_to_file(data, filename):
     try:
         with open(filename, "wb") as file:
             pickle.dump(data, file)
     except (FileNotFoundError, EOFError, pickle.UnpicklingError, ValueError) as e:
         print(f"Error saving to {filename}: {e}")
+    ledger_cache.invalidate(filename)
+
 
+def load_from_file(filename):
+    return ledger_cache.load(filename, lambda: _load_pickle(filename))
 
-def load_from_file(filename):    
+def _load_pickle(filename):
     try:
         with open(filename, "rb") as file:
             data = pickle.load(file)
@@ -27,24 +136,564 @@ def load_from_file(filename):
     except (FileNotFoundError, EOFError, pickle.UnpicklingError, ValueError) as e:
         print(f"Error loading from {filename}: {e}")
         return []
-    
+
+def read_records(path):
+    # the values of a file of checksummed records, a torn record at the end is cut off
+    values = []
+    try:
+        with open(path, "rb") as file:
+            data = file.read()
+    except FileNotFoundError:
+        return values
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        length, checksum = RECORD_HEADER.unpack_from(data, offset)
+        payload = data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+        if len(payload) != length or zlib.crc32(payload) != checksum:
+            break
+        try:
+            values.append(pickle.loads(payload))
+        except (EOFError, pickle.UnpicklingError, ValueError) as e:
+            print(f"Error loading from {path}: {e}")
+            break
+        offset += RECORD_HEADER.size + length
+    if offset != len(data):
+        with open(path, "r+b") as file:
+            file.truncate(offset)
+    return values
+
+def _encode_records(values):
+    payloads = [pickle.dumps(value) for value in values]
+    return b"".join(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload for payload in payloads)
+
+def append_records(path, values):
+    with open(path, "ab") as file:
+        file.write(_encode_records(values))
+        file.flush()
+        os.fsync(file.fileno())
+
+def write_records(path, values):
+    # replaces the file atomically
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as file:
+        file.write(_encode_records(values))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+class BlockLog:
+    """
+    Append-only ledger stored as segment files of length-prefixed block records.
+
+    Every record is a header (payload length, crc32) followed by the encoded block.
+    The side index holds one fixed-width entry per block height pointing at its record,
+    so appending a block writes one record and one index entry, and removing the tip
+    only truncates both files. A torn write at the end of a segment is dropped when
+    the log is opened instead of taking the rest of the ledger with it.
+
+    The index, the block hashes (one 32 byte slot per height) and the segments are
+    read through mmap, so a single block is fetched by height or by hash without
+    decoding the rest of the chain.
+
+    The PEM public keys of legacy transactions are kept once in a key table file
+    that the records refer to by index. The table only grows, and a key reaches
+    the disk before the first record that refers to it.
+    """
+
+    def __init__(self, folder, legacy_path=None):
+        self.folder = folder
+        self.legacy_path = legacy_path
+        self.index_path = os.path.join(folder, "index.dat")
+        self.hashes_path = os.path.join(folder, "hashes.dat")
+        self.keys_path = os.path.join(folder, "keys.dat")
+        self.lock = threading.RLock()
+        self.count = None
+        self.index_map = None
+        self.segment_maps = {}
+        self.heights_by_hash = None
+        self.key_refs = None # DER key -> index in the key table
+        self.keys = None # PEM keys by index
+
+    def _segment_path(self, segment):
+        return os.path.join(self.folder, f"blk{segment:05d}.dat")
+
+    def _open(self):
+        # load the side index once and repair it against the segment files
+        if self.count is not None:
+            return
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+        ders = read_records(self.keys_path)
+        self.key_refs = {der: index for index, der in enumerate(ders)}
+        self.keys = [cached_pem(der) for der in ders]
+
+        if not os.path.isfile(self.index_path) and os.path.isfile(self._segment_path(0)):
+            self._rebuild_index()
+
+        self.count = os.path.getsize(self.index_path) // INDEX_ENTRY.size if os.path.isfile(self.index_path) else 0
+
+        # drop index entries whose record did not fully reach the disk
+        while self.count and not self._record_is_intact(self._entry(self.count - 1)):
+            self.count -= 1
+        self._truncate_files(self.count)
+
+        if os.path.getsize(self.hashes_path) != self.count * HASH_ENTRY_SIZE:
+            self._rebuild_hashes()
+
+        # move a ledger written by older versions (one pickled list) into the log
+        if self.legacy_path and os.path.isfile(self.legacy_path):
+            if not self.count:
+                for block in load_from_file(self.legacy_path):
+                    self._append(block)
+            os.replace(self.legacy_path, self.legacy_path + ".bak")
+
+    def _rebuild_index(self):
+        # rebuild the index by walking every segment from the start
+        with open(self.index_path, "wb") as index_file:
+            segment = 0
+            while os.path.isfile(self._segment_path(segment)):
+                with open(self._segment_path(segment), "rb") as file:
+                    data = file.read()
+                offset = 0
+                while offset + RECORD_HEADER.size <= len(data):
+                    length, checksum = RECORD_HEADER.unpack_from(data, offset)
+                    payload = data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+                    if len(payload) != length or zlib.crc32(payload) != checksum:
+                        return
+                    index_file.write(INDEX_ENTRY.pack(segment, offset, length))
+                    offset += RECORD_HEADER.size + length
+                segment += 1
+
+    def _rebuild_hashes(self):
+        with open(self.hashes_path, "wb") as file:
+            for height in range(self.count):
+                file.write(self._hash_entry(self._read_record(self._entry(height))))
+
+    def _hash_entry(self, block):
+        # blocks without a well-formed sha256 hash get an empty slot and can't be looked up by hash
+        try:
+            entry = bytes.fromhex(getattr(block, "hash", None) or "")
+        except (TypeError, ValueError):
+            entry = b""
+        return entry if len(entry) == HASH_ENTRY_SIZE else bytes(HASH_ENTRY_SIZE)
+
+    def _entry(self, height):
+        if self.index_map is None:
+            with open(self.index_path, "rb") as file:
+                self.index_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return INDEX_ENTRY.unpack_from(self.index_map, height * INDEX_ENTRY.size)
+
+    def _segment_map(self, segment):
+        if segment not in self.segment_maps:
+            with open(self._segment_path(segment), "rb") as file:
+                self.segment_maps[segment] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.segment_maps[segment]
+
+    def _close_maps(self):
+        # mappings have a fixed size, so they are dropped before the files change
+        if self.index_map is not None:
+            self.index_map.close()
+            self.index_map = None
+        for segment_map in self.segment_maps.values():
+            segment_map.close()
+        self.segment_maps = {}
+
+    def _record_is_intact(self, entry):
+        segment, offset, length = entry
+        try:
+            with open(self._segment_path(segment), "rb") as file:
+                file.seek(offset)
+                record = file.read(RECORD_HEADER.size + length)
+        except FileNotFoundError:
+            return False
+        if len(record) != RECORD_HEADER.size + length:
+            return False
+        stored_length, checksum = RECORD_HEADER.unpack_from(record)
+        return stored_length == length and zlib.crc32(record[RECORD_HEADER.size:]) == checksum
+
+    def _truncate_files(self, height):
+        # cut the index and the segments back so that only the first `height` records remain
+        if height > 0:
+            segment, offset, length = self._entry(height - 1)
+            end = offset + RECORD_HEADER.size + length
+        else:
+            segment, end = 0, 0
+        self._close_maps()
+
+        with open(self.index_path, "ab") as file:
+            file.truncate(height * INDEX_ENTRY.size)
+        with open(self.hashes_path, "ab") as file:
+            file.truncate(min(file.tell(), height * HASH_ENTRY_SIZE))
+
+        if os.path.isfile(self._segment_path(segment)):
+            with open(self._segment_path(segment), "r+b") as file:
+                file.truncate(end)
+        segment += 1
+        while os.path.isfile(self._segment_path(segment)):
+            os.remove(self._segment_path(segment))
+            segment += 1
+
+        if self.heights_by_hash is not None:
+            self.heights_by_hash = {block_hash: h for block_hash, h in self.heights_by_hash.items() if h < height}
+        ledger_cache.invalidate(self.index_path)
+
+    def _read_record(self, entry):
+        segment, offset, length = entry
+        start = offset + RECORD_HEADER.size
+        return decode_value(RECORD_BLOCK, self._segment_map(segment)[start:start + length], self.keys)
+
+    def _append(self, block):
+        known_keys = len(self.key_refs)
+        payload = encode_value(RECORD_BLOCK, block, self.key_refs)
+        if len(self.key_refs) > known_keys:
+            new_keys = list(self.key_refs)[known_keys:]
+            append_records(self.keys_path, new_keys)
+            self.keys.extend(cached_pem(der) for der in new_keys)
+        if self.count:
+            segment, offset, length = self._entry(self.count - 1)
+            end = offset + RECORD_HEADER.size + length
+            if end + RECORD_HEADER.size + len(payload) > SEGMENT_SIZE:
+                segment, end = segment + 1, 0
+        else:
+            segment, end = 0, 0
+        self._close_maps()
+
+        with open(self._segment_path(segment), "ab") as file:
+            file.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            file.flush()
+            os.fsync(file.fileno())
+
+        with open(self.index_path, "ab") as file:
+            file.write(INDEX_ENTRY.pack(segment, end, len(payload)))
+        hash_entry = self._hash_entry(block)
+        with open(self.hashes_path, "ab") as file:
+            file.write(hash_entry)
+
+        if self.heights_by_hash is not None and any(hash_entry):
+            self.heights_by_hash[hash_entry] = self.count
+        self.count += 1
+        ledger_cache.invalidate(self.index_path)
+
+    def close(self):
+        # drop the open state, the next call reads the folder again
+        with self.lock:
+            self._close_maps()
+            self.count = None
+            self.heights_by_hash = None
+            self.key_refs = None
+            self.keys = None
+            ledger_cache.invalidate(self.index_path)
+
+    def __len__(self):
+        with self.lock:
+            self._open()
+            return self.count
+
+    def append(self, block):
+        with self.lock:
+            self._open()
+            self._append(block)
+
+    def read(self, height):
+        # fetch a single block by height, negative heights count from the tip
+        with self.lock:
+            self._open()
+            if height < 0:
+                height += self.count
+            if not 0 <= height < self.count:
+                return None
+            try:
+                return self._read_record(self._entry(height))
+            except (FileNotFoundError, EOFError, pickle.UnpicklingError, ValueError) as e:
+                print(f"Error loading block {height} from {self.folder}: {e}")
+                return None
+
+    def height_of(self, block_hash):
+        with self.lock:
+            self._open()
+            if self.heights_by_hash is None:
+                # built once from the mapped hash file, then kept up to date on writes
+                self.heights_by_hash = {}
+                if self.count:
+                    with open(self.hashes_path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as hashes:
+                        for height in range(self.count):
+                            entry = hashes[height * HASH_ENTRY_SIZE:(height + 1) * HASH_ENTRY_SIZE]
+                            if any(entry):
+                                self.heights_by_hash[entry] = height
+            try:
+                return self.heights_by_hash.get(bytes.fromhex(block_hash or ""))
+            except (TypeError, ValueError):
+                return None
+
+    def read_by_hash(self, block_hash):
+        height = self.height_of(block_hash)
+        return None if height is None else self.read(height)
+
+    def load(self, copy=False):
+        # copy=True decodes a chain of the caller's own instead of the shared cached one
+        with self.lock:
+            self._open()
+            if copy:
+                return self._load_all()
+            return ledger_cache.load(self.index_path, self._load_all)
+
+    def _load_all(self):
+        # read the whole chain in order
+        with self.lock:
+            blocks = []
+            try:
+                for height in range(self.count):
+                    blocks.append(self._read_record(self._entry(height)))
+            except (FileNotFoundError, EOFError, pickle.UnpicklingError, ValueError) as e:
+                print(f"Error loading from {self.folder}: {e}")
+            return blocks
+
+    def truncate(self, height):
+        with self.lock:
+            self._open()
+            if height < self.count:
+                self.count = max(height, 0)
+                self._truncate_files(self.count)
+
+    def save(self, blocks, start=0):
+        # replace every block from height `start` on with blocks[start:]
+        with self.lock:
+            self._open()
+            self.truncate(start)
+            for block in blocks[start:]:
+                self._append(block)
+
+    def update(self, height, block):
+        # records are variable length, so the tail after `height` is written again;
+        # only the newest block is ever pending, so in practice this is the tip alone
+        with self.lock:
+            self._open()
+            if height < 0:
+                height += self.count
+            tail = [self._read_record(self._entry(h)) for h in range(height + 1, self.count)]
+            self.truncate(height)
+            self._append(block)
+            for tail_block in tail:
+                self._append(tail_block)
+
+    def remove(self, height):
+        with self.lock:
+            self._open()
+            if height < 0:
+                height += self.count
+            if not 0 <= height < self.count:
+                return False
+            tail = [self._read_record(self._entry(h)) for h in range(height + 1, self.count)]
+            self.truncate(height)
+            for tail_block in tail:
+                self._append(tail_block)
+            return True
+
+block_log = BlockLog(blocks_folder, blockchain_file_path)
+
+
+class TransactionJournal:
+    """
+    Transaction pool kept as a journal of add and tombstone records.
+
+    An add record carries one transaction under a sequence number, a tombstone
+    carries the ids of any number of removed transactions, so adding costs one
+    record and removing a whole mined batch costs one record too. The pool is
+    the adds without a tombstone, in the order they were added, keyed by
+    Transaction.txid(); adding a transaction whose id is already in the pool
+    replaces it. Once tombstoned adds outnumber the live ones the journal is
+    compacted into a fresh file holding only the live adds.
+    """
+
+    def __init__(self, path, legacy_path=None):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.lock = threading.RLock()
+        self.next_seq = None
+        self.dead = 0
+        self.live_ids = set() # ids of the transactions in the pool
+        self.stamp = None # file stamp after the last replay or write made here
+        self.watchers = [] # indexes told about every change to the pool
+
+    def _replay(self):
+        # returns {txid: transaction} in pool order, the number of tombstoned adds and the next sequence number
+        live = {}
+        dead = 0
+        next_seq = 0
+        try:
+            with open(self.path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return live, dead, next_seq
+
+        # tombstones written by older versions name sequence numbers instead of ids
+        ids_by_seq = {}
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(data):
+            length, checksum = RECORD_HEADER.unpack_from(data, offset)
+            payload = data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+            if len(payload) != length or zlib.crc32(payload) != checksum:
+                break
+            try:
+                kind, value = _decode_journal_record(payload)
+            except (EOFError, pickle.UnpicklingError, ValueError) as e:
+                print(f"Error loading from {self.path}: {e}")
+                break
+            if kind == JOURNAL_ADD:
+                seq, transaction = value
+                txid = transaction.txid()
+                if live.pop(txid, None) is not None:
+                    dead += 1
+                live[txid] = transaction
+                ids_by_seq[seq] = txid
+                next_seq = max(next_seq, seq + 1)
+            else:
+                txids = value if kind == JOURNAL_REMOVE_IDS else [ids_by_seq.get(seq) for seq in value]
+                for txid in txids:
+                    if live.pop(txid, None) is not None:
+                        dead += 1
+            offset += RECORD_HEADER.size + length
+
+        if offset != len(data):
+            # a torn record at the end is dropped instead of blocking later appends
+            with open(self.path, "r+b") as file:
+                file.truncate(offset)
+            ledger_cache.invalidate(self.path)
+        return live, dead, next_seq
+
+    def _open(self):
+        # the pool's ids are kept in memory, the journal is only replayed again after another process wrote to it
+        if self.next_seq is not None and file_stamp(self.path) == self.stamp:
+            return
+        first_open = self.next_seq is None
+        live, dead, next_seq = self._replay()
+        self._reset(live, dead, next_seq)
+        for watcher in self.watchers:
+            watcher.reset(live)
+
+        # move a pool written by older versions (one pickled list) into the journal
+        if first_open and self.legacy_path and os.path.isfile(self.legacy_path):
+            if not self.live_ids:
+                for transaction in load_from_file(self.legacy_path):
+                    self.append(transaction)
+            os.replace(self.legacy_path, self.legacy_path + ".bak")
+
+    def watch(self, watcher):
+        # watcher.reset(live), added(txid, transaction) and removed(txids) are called with the journal locked
+        with self.lock:
+            self.watchers.append(watcher)
+            if self.next_seq is not None:
+                watcher.reset(self._replay()[0])
+
+    def sync(self):
+        # picks up writes made by another process
+        with self.lock:
+            self._open()
+
+    def _reset(self, live, dead, next_seq):
+        self.live_ids = set(live)
+        self.dead = dead
+        self.next_seq = next_seq
+        self.stamp = file_stamp(self.path)
+
+    def _write(self, kind, value):
+        payload = _encode_journal_record(kind, value)
+        with open(self.path, "ab") as file:
+            file.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            file.flush()
+            os.fsync(file.fileno())
+        self.stamp = file_stamp(self.path)
+        ledger_cache.invalidate(self.path)
+
+    def load(self, copy=False):
+        # copy=True decodes a pool of the caller's own instead of the shared cached one
+        with self.lock:
+            self._open()
+            if copy:
+                return self._load_live()
+            return ledger_cache.load(self.path, self._load_live)
+
+    def _load_live(self):
+        return list(self._replay()[0].values())
+
+    def append(self, transaction):
+        with self.lock:
+            self._open()
+            txid = transaction.txid()
+            self._write(JOURNAL_ADD, (self.next_seq, transaction))
+            self.next_seq += 1
+            if txid in self.live_ids:
+                # the add replaces the transaction with the same id
+                self.dead += 1
+            self.live_ids.add(txid)
+            for watcher in self.watchers:
+                watcher.added(txid, transaction)
+
+    def remove(self, txids):
+        # ids that are not in the pool are skipped, so the same removal can safely arrive twice
+        with self.lock:
+            self._open()
+            to_remove = sorted(self.live_ids.intersection(txids))
+            if not to_remove:
+                return False
+            self._write(JOURNAL_REMOVE_IDS, to_remove)
+            self.live_ids.difference_update(to_remove)
+            for watcher in self.watchers:
+                watcher.removed(to_remove)
+            self.dead += len(to_remove)
+            if self.dead > COMPACT_MIN_DEAD and self.dead > len(self.live_ids):
+                self.compact()
+            return True
+
+    def compact(self):
+        # write the live adds to a new file and swap it in atomically
+        with self.lock:
+            self._open()
+            live, _, _ = self._replay()
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "wb") as file:
+                for seq, transaction in enumerate(live.values()):
+                    payload = _encode_journal_record(JOURNAL_ADD, (seq, transaction))
+                    file.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.path)
+            self._reset(live, 0, len(live))
+            ledger_cache.invalidate(self.path)
+
+def _encode_journal_record(kind, value):
+    if kind == JOURNAL_ADD and RECORD_TRANSACTION in record_codecs:
+        seq, transaction = value
+        return JOURNAL_ADD_HEADER.pack(JOURNAL_RECORD_ADD, seq) + encode_value(RECORD_TRANSACTION, transaction)
+    if kind == JOURNAL_REMOVE_IDS:
+        return bytes((JOURNAL_RECORD_REMOVE_IDS,)) + b"".join(bytes.fromhex(txid) for txid in value)
+    return pickle.dumps((kind, value))
+
+def _decode_journal_record(payload):
+    # returns (kind, value), records written before the binary formats are pickled tuples
+    if payload[:1] == PICKLE_PROTO:
+        return pickle.loads(payload)
+    if payload[0] == JOURNAL_RECORD_ADD:
+        seq = JOURNAL_ADD_HEADER.unpack_from(payload)[1]
+        return JOURNAL_ADD, (seq, decode_value(RECORD_TRANSACTION, payload[JOURNAL_ADD_HEADER.size:]))
+    if payload[0] == JOURNAL_RECORD_REMOVE_IDS:
+        return JOURNAL_REMOVE_IDS, [payload[i:i + 32].hex() for i in range(1, len(payload), 32)]
+    raise ValueError(f"unknown journal record kind {payload[0]}")
+
+transaction_journal = TransactionJournal(transactions_journal_path, transactions_file_path)
+
 def setup_data_files():
     if not os.path.exists(data_folder):
         os.makedirs(data_folder)
 
-    if not os.path.isfile(blockchain_file_path):
-        data = []
-        with open(blockchain_file_path, 'wb') as file:
-            pickle.dump(data, file)
-
-    if not os.path.isfile(transactions_file_path):
-        data = []
-        with open(transactions_file_path, "wb") as file:
-            pickle.dump(data, file)
+    if not os.path.exists(blocks_folder):
+        os.makedirs(blocks_folder)
 
     if not os.path.isfile(last_mined_timestamp_path):
         data = []
         with open(last_mined_timestamp_path, "wb") as file:
             pickle.dump(data, file)
 
-setup_data_files()       
\ No newline at end of file
+setup_data_files()
@@ -1,31 +1,156 @@
 from notifications import notification
-from database import Database
 from miner_client import send_data_to_miner_servers, data_type_miner
-from utils import BLOCK_STATUS, calculate_balance, calculate_pending_balance, get_current_user_public_key, remove_from_file, sign, verify, print_header, get_all_transactions, display_menu_and_get_choice
-from storage import save_to_file, load_from_file, transactions_file_path, blockchain_file_path
+from utils import balance_index, pool_sender_index, get_current_user_address, address_of, address_registry, fetch_username_by_address, sign, verify, print_header, get_all_transactions, display_menu_and_get_choice
+from storage import transaction_journal, register_codec, RECORD_TRANSACTION
+from codec import FORMAT_VERSION, TAG, TAG_NONE, TAG_FIXED, TAG_PEM, TAG_KEY_REF, MAX_KEY_REFS, NO_VALIDATORS, Reader, encode_address, decode_address, pack_address, read_address, is_exact_double, encode_number, decode_number, encode_signature, decode_signature, encode_validators, decode_validators
+import hashlib
+import heapq
+import struct
+import threading
+from collections import OrderedDict
 import time
 from wallet_client import send_data_to_miner_servers
 
 REWARD_VALUE = 50
 NORMAL = 0
 REWARD = 1
+TX_HEADER = struct.Struct("<BB") # format version, type
+TX_FORMAT_VERSION = 2 # records of transactions signed over the binary payload, version 1 ones use the legacy payload
+TX_RECORD_VERSION = 3 # fixed-width record, used whenever every field has a fixed-width form
+TX_RECORD = struct.Struct("<BBBHdddd") # format version, type, signature version, layout, timestamp, input amount, output amount, fee
+# layout bits: input address tag, output address tag, which amounts are ints, whether there is a signature
+LAYOUT_OUTPUT_SHIFT = 4
+LAYOUT_ADDRESS_MASK = 15
+LAYOUT_INT_INPUT = 1 << 8
+LAYOUT_INT_OUTPUT = 1 << 9
+LAYOUT_INT_FEE = 1 << 10
+LAYOUT_SIGNED = 1 << 11
+SIG_VERSION_LEGACY = 1 # signature over str() of [input, output, fee]
+SIG_VERSION_BINARY = 2 # signature over the canonical binary payload
+SIGNING_HEADER = struct.Struct("<BBd") # signature version, type, timestamp
+AMOUNT = struct.Struct("<d")
+CHECK_SIGNATURE = "signature"
 
 class TransactionPool:
     def __init__(self):
         self.transactions = []
 
-    def add_transaction(self, transaction, filename):
+    def add_transaction(self, transaction):
         self.transactions.append(transaction)
-        self._save_transaction_to_file(transaction, filename)
+        self._save_transaction_to_file(transaction)
     
-    def _save_transaction_to_file(self, transaction, filename):
-        transactions = load_from_file(filename)
-        transactions.append(transaction)
-        save_to_file(transactions, filename)
+    def _save_transaction_to_file(self, transaction):
+        transaction_journal.append(transaction)
 
 transaction_pool = TransactionPool()
 
+class Mempool:
+    """
+    Pool transactions ordered by fee and by age, for picking what goes into a block.
+
+    Both orders are binary heaps, so adding and popping cost O(log n). Removing is
+    O(1): the entry is dropped from the key map and its heap items are skipped once
+    they come up. Entries are keyed by Transaction.txid(). Each add gets a
+    sequence number, so a key that is removed and added again doesn't bring its
+    old heap items back.
+    """
+
+    def __init__(self, transactions=()):
+        self.entries = {} # key -> (sequence number, transaction)
+        self.by_fee = []
+        self.by_age = []
+        self.next_seq = 0
+        for tx in transactions:
+            fee_item, age_item = self._entry(tx.txid(), tx)
+            self.by_fee.append(fee_item)
+            self.by_age.append(age_item)
+        heapq.heapify(self.by_fee)
+        heapq.heapify(self.by_age)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def _entry(self, key, tx):
+        seq = self.next_seq
+        self.next_seq += 1
+        self.entries[key] = (seq, tx)
+        # highest fee first, older transactions first among equal fees
+        return (-tx.fee, tx.timestamp, seq, key), (tx.timestamp, seq, key)
+
+    def add(self, key, tx):
+        self.remove(key)
+        fee_item, age_item = self._entry(key, tx)
+        heapq.heappush(self.by_fee, fee_item)
+        heapq.heappush(self.by_age, age_item)
+
+    def remove(self, key):
+        return self.entries.pop(key, None) is not None
+
+    def _pop(self, heap):
+        while heap:
+            item = heapq.heappop(heap)
+            seq, key = item[-2:]
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == seq:
+                del self.entries[key]
+                return key, entry[1]
+        return None
+
+    def pop_highest_fee(self):
+        # returns (key, transaction), or None when the pool is empty
+        return self._pop(self.by_fee)
+
+    def pop_oldest(self):
+        return self._pop(self.by_age)
+
+class VerifiedTransactionCache:
+    """
+    The checks each transaction passed, keyed by Transaction.digest().
+
+    The digest covers every field and the signature, so a transaction that was
+    changed in any way is a new entry. Only checks that depend on nothing but the
+    transaction itself are recorded, the balance check depends on the chain and
+    always runs. Failed checks aren't recorded: a signature of a user who isn't
+    known to this node yet can pass later.
+    """
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def passed(self, digest, check):
+        with self.lock:
+            checks = self.entries.get(digest)
+            if checks is not None and check in checks:
+                self.entries.move_to_end(digest)
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def record(self, digest, check):
+        with self.lock:
+            self.entries.setdefault(digest, set()).add(check)
+            self.entries.move_to_end(digest)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.entries), "hit_rate": self.hits / total if total else 0.0}
+
+verified_transactions = VerifiedTransactionCache()
+
 class Transaction:
+    __slots__ = ("timestamp", "type", "input", "output", "sig", "fee", "validators", "sig_version")
+
     def __init__(self, type = NORMAL, fee=0):
         self.timestamp = time.time()
         self.type = type
@@ -34,6 +159,7 @@ class Transaction:
         self.sig = None
         self.fee = fee
         self.validators = []
+        self.sig_version = SIG_VERSION_BINARY
 
     def add_input(self, from_addr, amount):
         self.input = (from_addr, amount)
@@ -46,13 +172,36 @@ class Transaction:
         self.sig = sign(message, private)
     
     def _has_valid_signature(self, message, addr):
-        return verify(message, self.sig, addr)
+        digest = self.digest()
+        if verified_transactions.passed(digest, CHECK_SIGNATURE):
+            return True
+        # transactions name accounts by address, the registry has the key to check against
+        public_key = address_registry.public_key(addr)
+        if public_key is None:
+            return False
+        if not verify(message, self.sig, public_key):
+            return False
+        verified_transactions.record(digest, CHECK_SIGNATURE)
+        return True
+
+    def signature_job(self):
+        # the arguments of the signature check in is_valid, so that it can run in another process
+        entry = self.output if self.type == REWARD else self.input
+        if entry is None:
+            return None
+        public_key = address_registry.public_key(entry[0])
+        if public_key is None:
+            return None
+        return (self._prepare_data_for_signature(), self.sig, public_key)
                
-    def is_valid(self):
+    def is_valid(self, signature_valid=None):
+        # signature_valid is the outcome of signature_job when it was checked beforehand
         if self.type == REWARD:
             if self.input is not None or self.output is None:
                 return False
-            if not self._has_valid_signature(self._prepare_data_for_signature(), self.output[0]):
+            if signature_valid is None:
+                signature_valid = self._has_valid_signature(self._prepare_data_for_signature(), self.output[0])
+            if not signature_valid:
                 return False
             return True
         
@@ -67,35 +216,168 @@ class Transaction:
             return False
         
         # Check if the signature is valid for the given input address
-        if not self._has_valid_signature(self._prepare_data_for_signature(), self.input[0]):
+        if signature_valid is None:
+            signature_valid = self._has_valid_signature(self._prepare_data_for_signature(), self.input[0])
+        if not signature_valid:
             return False
         
         # check if enough balance
-        chain = load_from_file(blockchain_file_path)
-        pool_transactions = load_from_file(transactions_file_path)
-        available_balance = 0
-        pending_balance = 0
-        for block in chain:
-            if block.status == BLOCK_STATUS[1] and block.transactions[-1].output[0] == self.input[0]:
-                available_balance += calculate_balance(self.input[0], block.transactions, True)
-            elif block.status == BLOCK_STATUS[1]:
-                available_balance += calculate_balance(self.input[0], block.transactions)
-            elif block.status == BLOCK_STATUS[0]:
-                pending_balance += calculate_pending_balance(self.input[0], block.transactions)
-
-        if pool_transactions:
-            pending_balance += calculate_pending_balance(self.input[0],pool_transactions)
-
-        if (self.input[1] + self.fee) > (available_balance - pending_balance):
+        available_balance = balance_index.verified_balance(address_of(self.input[0]))
+
+        if (self.input[1] + self.fee) > available_balance:
             return False
 
         return True
 
     def _prepare_data_for_signature(self):
-        return [self.input, self.output, self.fee]
+        if self.sig_version == SIG_VERSION_LEGACY:
+            return [self.input, self.output, self.fee]
+        # fixed field order, amounts as 8 byte floats and addresses as their raw bytes
+        data = SIGNING_HEADER.pack(self.sig_version, self.type, self.timestamp)
+        for entry in (self.input, self.output):
+            if entry is None:
+                data += TAG.pack(TAG_NONE)
+            else:
+                data += encode_address(entry[0]) + AMOUNT.pack(entry[1])
+        return data + AMOUNT.pack(self.fee)
+
+    def txid(self):
+        # derived from the signed fields, so it is the same on every node
+        message = self._prepare_data_for_signature()
+        if not isinstance(message, bytes):
+            # the legacy signed list has no timestamp, without it two equal transfers would share an id
+            message = bytes(str([self.timestamp, message]), 'utf-8')
+        return hashlib.sha256(message).hexdigest()
+
+    def to_bytes(self, keys=None):
+        # compact binary form, see codec.py for the field encodings;
+        # keys is the {DER: index} key table of the block the transaction is written in
+        record = self._record_bytes(keys)
+        if record is None:
+            record = self._content_bytes()
+        return record + encode_validators(self.validators)
+
+    def _record_bytes(self, keys):
+        # the fixed-width record, None when a field has no exact fixed-width form
+        if type(self.timestamp) is not float or not is_exact_double(self.fee) or not 0 <= self.type < 256:
+            return None
+        if self.sig is not None and (not isinstance(self.sig, bytes) or len(self.sig) > 255):
+            return None
+        layout = LAYOUT_INT_FEE if type(self.fee) is int else 0
+        amounts = []
+        addresses = b""
+        for entry, shift, int_flag in ((self.input, 0, LAYOUT_INT_INPUT), (self.output, LAYOUT_OUTPUT_SHIFT, LAYOUT_INT_OUTPUT)):
+            if entry is None:
+                amounts.append(0.0)
+                continue
+            packed = pack_address(entry[0])
+            if packed is None or not is_exact_double(entry[1]):
+                return None
+            tag, raw = packed
+            if tag == TAG_PEM and keys is not None and (raw in keys or len(keys) < MAX_KEY_REFS):
+                tag, raw = TAG_KEY_REF, TAG.pack(keys.setdefault(raw, len(keys)))
+            layout |= tag << shift
+            if type(entry[1]) is int:
+                layout |= int_flag
+            addresses += raw
+            amounts.append(entry[1])
+        signature = b""
+        if self.sig is not None:
+            layout |= LAYOUT_SIGNED
+            signature = TAG.pack(len(self.sig)) + self.sig
+        header = TX_RECORD.pack(TX_RECORD_VERSION, self.type, self.sig_version, layout, self.timestamp, amounts[0], amounts[1], self.fee)
+        return header + addresses + signature
+
+    def _content_bytes(self):
+        version = FORMAT_VERSION if self.sig_version == SIG_VERSION_LEGACY else TX_FORMAT_VERSION
+        data = TX_HEADER.pack(version, self.type) + encode_number(self.timestamp)
+        for entry in (self.input, self.output):
+            if entry is None:
+                data += TAG.pack(TAG_NONE)
+            else:
+                data += TAG.pack(TAG_FIXED) + encode_address(entry[0]) + encode_number(entry[1])
+        return data + encode_number(self.fee) + encode_signature(self.sig)
+
+    def digest(self):
+        # sha256 over everything but the validator flags, which are added after the transaction is mined
+        return hashlib.sha256(self._content_bytes()).digest()
+
+    @classmethod
+    def from_bytes(cls, data, keys=None):
+        return cls.read_from(Reader(data), keys)
+
+    @classmethod
+    def read_from(cls, reader, keys=None):
+        # keys is the PEM key table of the block being read, by index
+        if reader.data[reader.offset] == TX_RECORD_VERSION:
+            return cls._read_record(reader, keys)
+        version, type = reader.unpack(TX_HEADER)
+        if version not in (FORMAT_VERSION, TX_FORMAT_VERSION):
+            raise ValueError(f"Unknown transaction format version {version}")
+        tx = cls.__new__(cls)
+        tx.sig_version = SIG_VERSION_LEGACY if version == FORMAT_VERSION else SIG_VERSION_BINARY
+        tx.type = type
+        tx.timestamp = decode_number(reader)
+        entries = []
+        for _ in range(2):
+            if reader.tag() == TAG_NONE:
+                entries.append(None)
+            else:
+                entries.append((decode_address(reader), decode_number(reader)))
+        tx.input, tx.output = entries
+        tx.fee = decode_number(reader)
+        tx.sig = decode_signature(reader)
+        tx.validators = decode_validators(reader)
+        return tx
+
+    @classmethod
+    def _read_record(cls, reader, keys):
+        data = reader.data
+        _, tx_type, sig_version, layout, timestamp, input_amount, output_amount, fee = TX_RECORD.unpack_from(data, reader.offset)
+        offset = reader.offset + TX_RECORD.size
+        tx = cls.__new__(cls)
+        tx.type = tx_type
+        tx.sig_version = sig_version
+        tx.timestamp = timestamp
+        tx.fee = int(fee) if layout & LAYOUT_INT_FEE else fee
+        tag = layout & LAYOUT_ADDRESS_MASK
+        tx.input = None
+        if tag != TAG_NONE:
+            address, offset = read_address(data, offset, tag, keys)
+            tx.input = (address, int(input_amount) if layout & LAYOUT_INT_INPUT else input_amount)
+        tag = (layout >> LAYOUT_OUTPUT_SHIFT) & LAYOUT_ADDRESS_MASK
+        tx.output = None
+        if tag != TAG_NONE:
+            address, offset = read_address(data, offset, tag, keys)
+            tx.output = (address, int(output_amount) if layout & LAYOUT_INT_OUTPUT else output_amount)
+        tx.sig = None
+        if layout & LAYOUT_SIGNED:
+            end = offset + 1 + data[offset]
+            tx.sig = data[offset + 1:end]
+            offset = end
+        if data[offset:offset + 2] == NO_VALIDATORS:
+            # almost every transaction, only flagged ones carry validators
+            tx.validators = []
+            reader.offset = offset + 2
+        else:
+            reader.offset = offset
+            tx.validators = decode_validators(reader)
+        return tx
+
+    def __reduce__(self):
+        # pickles (network messages) carry the compact form
+        return (Transaction.from_bytes, (self.to_bytes(),))
+
+    def __setstate__(self, state):
+        # transactions pickled before __slots__ carry their __dict__
+        if isinstance(state, tuple):
+            state = state[1]
+        self.sig_version = SIG_VERSION_LEGACY
+        for name, value in state.items():
+            setattr(self, name, value)
 
     def view_transactions(self, username):
-        transactions = get_all_transactions(transactions_file_path)
+        transactions = get_all_transactions()
         options = [
         {"option": "1", "text": "Back to main menu", "action": lambda: "back"}
         ]
@@ -142,33 +424,27 @@ class Transaction:
                 f"SIGNATURE:\n{self.sig}\n"
                 f"END\n")
     
+register_codec(RECORD_TRANSACTION, Transaction.to_bytes, Transaction.from_bytes)
+
 def cancel_invalid_transactions(username):
-    db = Database()
-    pool_transactions = load_from_file(transactions_file_path)
-    public_key = get_current_user_public_key(username)
+    address = get_current_user_address(username)
     
-    if pool_transactions:
-        for tx in reversed(pool_transactions):
-            if tx.input:
-                if tx.input[0] == public_key:
-                    if len(tx.validators) > 0:
-                        index = pool_transactions.index(tx)
-                        # delete from pool
-                        remove_from_file(transactions_file_path, index)
-                        # send to servers
-                        send_data_to_miner_servers((data_type_miner[2], index)) 
-                        #notify user
-                        receiver = db.fetch('SELECT username FROM users WHERE publickey=?', (tx.output[0], ))
-                        if receiver:
-                            notification.add_notification(username, f"rejected transaction: send {tx.input[1]} coin(s) to {receiver[0][0]} including transaction fee of {tx.fee} coins")   
-                            send_data_to_miner_servers((data_type_miner[3], f"rejected transaction: send {tx.input[1]} coin(s) to {receiver[0][0]} including transaction fee of {tx.fee} coins"))             
-            elif tx.input == None: # if there is an invalid reward transaction
-                if tx.output[0] == public_key:
-                    if len(tx.validators) > 0:
-                        remove_from_file(transactions_file_path, index)
-                        send_data_to_miner_servers((data_type_miner[2], index))
-                        receiver = db.fetch('SELECT username FROM users WHERE publickey=?', (tx.output[0], ))
-                        notification.add_notification(username, f"reward of {tx.input[1]} coin(s) rejected")
-                        send_data_to_miner_servers((data_type_miner[3], f"reward of {tx.input[1]} coin(s) rejected"))   
-            
-            
\ No newline at end of file
+    txids_to_remove = set()
+    for txid, tx in pool_sender_index.transactions_of(address):
+        if tx.input:
+            if len(tx.validators) > 0:
+                txids_to_remove.add(txid)
+                #notify user
+                receiver = fetch_username_by_address(tx.output[0])
+                if receiver:
+                    notification.add_notification(username, f"rejected transaction: send {tx.input[1]} coin(s) to {receiver[0][0]} including transaction fee of {tx.fee} coins")   
+        elif tx.input == None: # if there is an invalid reward transaction
+            if len(tx.validators) > 0:
+                txids_to_remove.add(txid)
+                notification.add_notification(username, f"reward of {tx.output[1]} coin(s) rejected")
+
+    if txids_to_remove:
+        # delete from pool in one journal write
+        transaction_journal.remove(txids_to_remove)
+        # send to servers
+        send_data_to_miner_servers((data_type_miner[5], txids_to_remove))   
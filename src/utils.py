@@ -3,8 +3,13 @@ from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import ec
 from database import Database
-from storage import load_from_file, save_to_file, blockchain_file_path, transactions_file_path
+from storage import block_log, transaction_journal, ledger_cache, balances_file_path, read_records, append_records, write_records
+from codec import pem_to_der
+import functools
+import hashlib
 import os
+import pickle
+import threading
 
 BLOCK_STATUS = ["pending", "verified", "rejected", "genesis"]
 
@@ -73,18 +78,95 @@ def get_current_user_public_key(username):
         return user_data[0][0]
     return None
 
+def public_key_to_address(public_key):
+    # short account identifier used in transactions: first 20 bytes of sha256 over the DER key, as hex
+    if isinstance(public_key, str):
+        public_key = public_key.encode('utf-8')
+    return hashlib.sha256(pem_to_der(public_key)).digest()[:20].hex()
+
+@functools.lru_cache(maxsize=1024)
+def _address_of_public_key(public_key):
+    return public_key_to_address(public_key)
+
+def address_of(addr):
+    # transactions made before short addresses carry the full PEM public key
+    if isinstance(addr, bytes):
+        return _address_of_public_key(addr)
+    return addr
+
+def get_current_user_address(username):
+    public_key = get_current_user_public_key(username)
+    if public_key:
+        return public_key_to_address(public_key)
+    return None
+
+class AddressRegistry:
+    """
+    Maps short addresses back to the PEM public keys that are needed to check signatures.
+
+    Users are only ever added, so a miss reads just the rows added since the last
+    read, and only when the highest user id shows there are any. An unknown
+    address costs one small query and the database is read without the lock held.
+    """
+
+    def __init__(self):
+        self.public_keys = {}
+        self.last_id = 0 # highest users ID read so far
+        self.lock = threading.Lock()
+
+    def public_key(self, address):
+        if isinstance(address, bytes):
+            return address
+        public_key = self.public_keys.get(address)
+        if public_key is None and self._refresh():
+            public_key = self.public_keys.get(address)
+        return public_key
+
+    def _refresh(self):
+        # returns True when new users were read
+        db = Database()
+        last_id = self.last_id
+        (max_id, ), = db.fetch('SELECT MAX(ID) FROM users')
+        if max_id is None or max_id <= last_id:
+            return False
+        rows = db.fetch('SELECT ID, publickey FROM users WHERE ID > ?', (last_id, ))
+        with self.lock:
+            for user_id, public_key in rows:
+                self.public_keys[public_key_to_address(public_key)] = public_key
+                self.last_id = max(self.last_id, user_id)
+        return True
+
+address_registry = AddressRegistry()
+
+def fetch_username_by_address(address):
+    db = Database()
+    return db.fetch('SELECT username FROM users WHERE publickey=?', (address_registry.public_key(address), ))
+
 
 def sign(message, private_key):
-    message = bytes(str(message), 'utf-8')
+    # binary signing payloads are signed as they are, anything else as its str()
+    if not isinstance(message, bytes):
+        message = bytes(str(message), 'utf-8')
     signature = private_key.sign(
         message,
         ec.ECDSA(hashes.SHA256())
         )
     return signature
 
+@functools.lru_cache(maxsize=256)
+def load_public_key(pbc_ser):
+    # validating a chain checks the same few senders over and over, parse each PEM key once
+    return serialization.load_pem_public_key(pbc_ser)
+
+def public_key_cache_stats():
+    info = load_public_key.cache_info()
+    total = info.hits + info.misses
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "hit_rate": info.hits / total if total else 0.0}
+
 def verify(message, signature, pbc_ser):
-    message = bytes(str(message), 'utf-8')
-    public_key = serialization.load_pem_public_key(pbc_ser)
+    if not isinstance(message, bytes):
+        message = bytes(str(message), 'utf-8')
+    public_key = load_public_key(pbc_ser)
     try:
         public_key.verify(
             signature,
@@ -98,54 +180,99 @@ def verify(message, signature, pbc_ser):
         print("Error executing 'public_key.verify'")
         return False
     
-def find_index_from_file(filename, input, public_key_sender, public_key_receiver, fee):
-    # Load all data from the file
-    all_data = load_from_file(filename)
-
-    # Find the index of the data that contains the target_input
-    index = 0
-    for tx in all_data:
-        if tx.type == 0 and tx.input[1] == input and tx.input[0] == public_key_sender and tx.output[0] == public_key_receiver and tx.fee == fee:
-            return index
-        index += 1
-    return None
-
-def find_index_from_file_by_public_key(filename, public_key):
-    # Load all data from the file
-    all_data = load_from_file(filename)
-
-    # Find the index of the data that contains the target_input
-    index = 0
-    for tx in all_data:
-        if tx.type == 1 and tx.output[0] == public_key:
-            return index
-        index += 1
+class PoolSenderIndex:
+    """
+    Pool transactions grouped by the address that sent them, with their transaction id.
+
+    A reward transaction has no sender and is filed under its receiver. The
+    journal tells the index about every add and removal, so the groups stay
+    current without reading the pool again, and looking up a user's transactions
+    costs time in the number of transactions of that user. Transactions are kept
+    pickled and every lookup unpickles its own copies.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_sender = {} # address -> {txid: pickled transaction} in pool order
+        self.sender_of = {} # txid -> address
+
+    def reset(self, live):
+        with self.lock:
+            self.by_sender = {}
+            self.sender_of = {}
+            for txid, tx in live.items():
+                self._add(txid, tx)
+
+    def added(self, txid, tx):
+        with self.lock:
+            # an add with an id already in the pool replaces it at the end of the pool
+            self._drop(txid)
+            self._add(txid, tx)
+
+    def removed(self, txids):
+        with self.lock:
+            for txid in txids:
+                self._drop(txid)
+
+    def _add(self, txid, tx):
+        entry = tx.input if tx.input else tx.output
+        address = address_of(entry[0])
+        self.by_sender.setdefault(address, {})[txid] = pickle.dumps(tx)
+        self.sender_of[txid] = address
+
+    def _drop(self, txid):
+        address = self.sender_of.pop(txid, None)
+        if address is not None:
+            group = self.by_sender[address]
+            del group[txid]
+            if not group:
+                del self.by_sender[address]
+
+    def transactions_of(self, address):
+        # [(txid, transaction), ...] in pool order
+        transaction_journal.sync()
+        with self.lock:
+            group = list(self.by_sender.get(address, {}).items())
+        return [(txid, pickle.loads(data)) for txid, data in group]
+
+pool_sender_index = PoolSenderIndex()
+transaction_journal.watch(pool_sender_index)
+
+def find_txid_from_file(input, sender_address, receiver_address, fee):
+    # Find the id of the transaction that contains the target_input
+    for txid, tx in pool_sender_index.transactions_of(sender_address):
+        if tx.type == 0 and tx.input[1] == input and address_of(tx.output[0]) == receiver_address and tx.fee == fee:
+            return txid, tx
+    return None, None
+
+def find_txid_from_file_by_address(address):
+    # Find the id of the reward transaction of the address
+    for txid, tx in pool_sender_index.transactions_of(address):
+        if tx.type == 1:
+            return txid
     return None
 
-def get_user_transactions(filename, current_user):
-    public_key = get_current_user_public_key(current_user)
-    all_data = load_from_file(filename)
-    db = Database()
+def get_user_transactions(current_user):
+    address = get_current_user_address(current_user)
     user_transactions = []
     count=1
-    for tx in all_data:
+    for _, tx in pool_sender_index.transactions_of(address):
         if tx.type == 0:
-            if tx.input[0] == public_key:
-                get_username = db.fetch('SELECT username FROM users WHERE publickey=?', (tx.output[0], ))
+            if address_of(tx.input[0]) == address:
+                get_username = fetch_username_by_address(tx.output[0])
                 user_transactions.append([count, tx.input[1], get_username[0][0], tx.fee])
                 count += 1
 
     return user_transactions
 
-def get_all_transactions(filename):
-    all_data = load_from_file(filename)
-    db = Database()
+def get_all_transactions():
+    all_data = transaction_journal.load()
     user_transactions = []
     count=1
     for tx in all_data:
-        get_receiver_username = db.fetch('SELECT username FROM users WHERE publickey=?', (tx.output[0], ))
+        get_receiver_username = fetch_username_by_address(tx.output[0])
         if tx.type == 0:
-            get_sender_username = db.fetch('SELECT username FROM users WHERE publickey=?', (tx.input[0], ))
+            get_sender_username = fetch_username_by_address(tx.input[0])
             user_transactions.append([count, tx.input[1], get_receiver_username[0][0], get_sender_username[0][0], tx.fee, tx.type, tx.timestamp, tx.validators])
         else:
             user_transactions.append([count, tx.output[1], get_receiver_username[0][0], tx.type, tx.timestamp, tx.validators])
@@ -153,14 +280,13 @@ def get_all_transactions(filename):
 
     return user_transactions
 
-def get_all_transactions_in_block(chain, block_index):
-    db = Database()
+def get_all_transactions_in_block(block):
     user_transactions = []
     count=1
-    for tx in chain[block_index].transactions:
-        get_receiver_username = db.fetch('SELECT username FROM users WHERE publickey=?', (tx.output[0], ))
+    for tx in block.transactions:
+        get_receiver_username = fetch_username_by_address(tx.output[0])
         if tx.type == 0:
-            get_sender_username = db.fetch('SELECT username FROM users WHERE publickey=?', (tx.input[0], ))
+            get_sender_username = fetch_username_by_address(tx.input[0])
             user_transactions.append([count, tx.input[1], get_receiver_username[0][0], get_sender_username[0][0], tx.fee, tx.type])
         else:
             user_transactions.append([count, tx.output[1], get_receiver_username[0][0], tx.type])
@@ -168,96 +294,273 @@ def get_all_transactions_in_block(chain, block_index):
 
     return user_transactions
 
-def get_username_miner(filename, index):
-    all_data = load_from_file(filename)
-    db = Database()
-    get_miner_username = db.fetch('SELECT username FROM users WHERE publickey=?', (all_data[index].transactions[-1].output[0], ))
+def get_username_miner(index):
+    block = block_log.read(index)
+    get_miner_username = fetch_username_by_address(block.transactions[-1].output[0])
     return get_miner_username[0][0]
 
-def remove_from_file(filename, index):
-    # Load all data from the file
-    all_data = load_from_file(filename)
-
-    # Check if the index is valid
-    if 0 <= index < len(all_data):
-        # Delete the entry 
-        del all_data[index]
-        # Save the modified data back to the file
-        save_to_file(all_data, filename)
-        return True
-    return False
-
-
-def calculate_balance(public_key, transactions, include_fee=False):
+def calculate_balance(address, transactions, include_fee=False):
     balance = 0
     for tx in transactions:
         if tx.output:
             output_addr, tx_amount = tx.output
-            if output_addr == public_key:
+            if address_of(output_addr) == address:
                 balance += tx_amount
         if tx.input:
             input_addr, tx_amount = tx.input
-            if input_addr == public_key:
+            if address_of(input_addr) == address:
                 balance -= tx_amount
                 balance -=tx.fee
         if include_fee:
                 balance += tx.fee
     return balance
 
-def calculate_pending_balance(public_key, transactions):
+def calculate_pending_balance(address, transactions):
     balance = 0
     for tx in transactions:
         if tx.input:
             input_addr, tx_amount = tx.input
-            if input_addr == public_key:
+            if address_of(input_addr) == address:
                 balance += tx_amount
                 balance += tx.fee
             if tx.input:
                 input_addr, tx_amount = tx.input
-                if input_addr == public_key:
+                if address_of(input_addr) == address:
                     balance -= tx_amount
                     balance -=tx.fee
     return balance
 
-def calculate_spendable_balance(public_key, transactions):
+def calculate_spendable_balance(address, transactions):
     balance = 0
     for tx in transactions:
         if tx.type == 0:
             if tx.output:
                 output_addr, tx_amount = tx.output
-                if output_addr == public_key:
+                if address_of(output_addr) == address:
                     balance += tx_amount
             if tx.input:
                 input_addr, tx_amount = tx.input
-                if input_addr == public_key:
+                if address_of(input_addr) == address:
                     balance -= tx_amount
                     balance -=tx.fee
     return balance
 
+def calculate_block_balances(block):
+    # the balance change of every address in one block, summed like calculate_balance
+    balances = {}
+    if not block.transactions or block.status not in (BLOCK_STATUS[0], BLOCK_STATUS[1]):
+        return balances
+    miner_address = address_of(block.transactions[-1].output[0])
+    for tx in block.transactions:
+        if tx.output:
+            output_addr, tx_amount = tx.output
+            output_addr = address_of(output_addr)
+            balances[output_addr] = balances.get(output_addr, 0) + tx_amount
+        if tx.input:
+            input_addr, tx_amount = tx.input
+            input_addr = address_of(input_addr)
+            balances[input_addr] = balances.get(input_addr, 0) - tx_amount
+            balances[input_addr] -= tx.fee
+        # the miner collects every fee in the block
+        balances[miner_address] = balances.get(miner_address, 0) + tx.fee
+    return balances
+
+BALANCES_HEIGHT = "height"
+BALANCES_DROP = "drop"
+BALANCES_COMPACT_MIN = 64 # records beyond twice the heights tolerated before balances.log is rewritten
+
+class BalanceIndex:
+    """
+    Per-address balances of the ledger, so a balance check doesn't scan the chain.
+
+    For every block height the index keeps the block hash, its status and the
+    balance change it makes, and per address the totals of the verified blocks,
+    of the pending blocks and of the spendable pool transactions. When the block
+    log changes the index walks back from the tip to the last height that still
+    has the same hash and status and only reads the blocks after it, which is the
+    tip alone for a mined, validated or rejected block. The journal tells the
+    index about every pool add and removal, which moves the pool totals by the
+    amounts of that transaction alone.
+
+    The block part is persisted in balances.log as records appended per change,
+    one per height read again and one for heights dropped, so a new block costs
+    one small write. The file is rewritten with only the current heights once
+    it holds more than twice as many records.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.heights = [] # (hash, status, balances) per block height
+        self.records = 0 # records in the file
+        self.verified = {}
+        self.pending = {}
+        self.pool = {}
+        self.pool_entries = {} # txid -> balance changes of a pool transaction
+        self.pool_counts = {} # address -> pool transactions with a change for it
+        self.blocks_version = None
+
+    def balances(self, address):
+        # returns the verified, pending block and spendable pool balance of an address
+        self.update()
+        with self.lock:
+            return self.verified.get(address, 0), self.pending.get(address, 0), self.pool.get(address, 0)
+
+    def verified_balance(self, address):
+        # what an address can spend on a new transaction: the spends of pending blocks
+        # and of the pool net to zero in calculate_pending_balance, so only the verified
+        # balance counts
+        return self.balances(address)[0]
+
+    def update(self):
+        # the journal lock is taken before the index lock, as the journal does when it calls the index
+        transaction_journal.sync()
+        with self.lock:
+            self._load()
+            chain_length = len(block_log)
+            version = ledger_cache.version(block_log.index_path)
+            if version != self.blocks_version:
+                self._update_blocks(chain_length)
+                self.blocks_version = version
+
+    def rebuild(self):
+        with self.lock:
+            self.loaded = True
+            self.heights, self.verified, self.pending = [], {}, {}
+            write_records(self.path, [])
+            self.records = 0
+            self.blocks_version = None
+        self.update()
+
+    def reset(self, live):
+        with self.lock:
+            self.pool, self.pool_entries, self.pool_counts = {}, {}, {}
+            for txid, tx in live.items():
+                self._add_pool(txid, tx)
+
+    def added(self, txid, tx):
+        with self.lock:
+            # an add with an id already in the pool replaces it
+            self._drop_pool(txid)
+            self._add_pool(txid, tx)
+
+    def removed(self, txids):
+        with self.lock:
+            for txid in txids:
+                self._drop_pool(txid)
+
+    def _add_pool(self, txid, tx):
+        entries = self._pool_entries(tx)
+        self.pool_entries[txid] = entries
+        for addr, amount in entries:
+            self.pool[addr] = self.pool.get(addr, 0) + amount
+            self.pool_counts[addr] = self.pool_counts.get(addr, 0) + 1
+
+    def _drop_pool(self, txid):
+        for addr, amount in self.pool_entries.pop(txid, ()):
+            self.pool_counts[addr] -= 1
+            if self.pool_counts[addr]:
+                self.pool[addr] -= amount
+            else:
+                # the last transaction of an address leaves no rounding behind
+                del self.pool_counts[addr]
+                del self.pool[addr]
+
+    def _load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        records = read_records(self.path)
+        for kind, value in records:
+            if kind == BALANCES_DROP:
+                del self.heights[value:]
+            else:
+                height, entry = value
+                del self.heights[height:]
+                self.heights.append(entry)
+        self.records = len(records)
+        self.verified = self._sum_heights(BLOCK_STATUS[1])
+        self.pending = self._sum_heights(BLOCK_STATUS[0])
+
+    def _update_blocks(self, chain_length):
+        # find the last height the index agrees with, everything after it is read again
+        height = min(chain_length, len(self.heights))
+        while height > 0:
+            block = block_log.read(height - 1)
+            if block is not None and self.heights[height - 1][:2] == (block.hash, block.status):
+                break
+            height -= 1
+        if height == len(self.heights) == chain_length:
+            return
+
+        records = []
+        if height < len(self.heights):
+            self._drop_heights(height)
+            records.append((BALANCES_DROP, height))
+        if height == 0:
+            blocks = block_log.load()
+        else:
+            blocks = [block_log.read(h) for h in range(height, chain_length)]
+        for block in blocks:
+            if block is not None:
+                self._add_block(block)
+                records.append((BALANCES_HEIGHT, (len(self.heights) - 1, self.heights[-1])))
+        self._persist(records)
+
+    def _persist(self, records):
+        if self.records + len(records) > 2 * len(self.heights) + BALANCES_COMPACT_MIN:
+            write_records(self.path, [(BALANCES_HEIGHT, (h, entry)) for h, entry in enumerate(self.heights)])
+            self.records = len(self.heights)
+        elif records:
+            append_records(self.path, records)
+            self.records += len(records)
+
+    def _add_block(self, block):
+        balances = calculate_block_balances(block)
+        self.heights.append((block.hash, block.status, balances))
+        totals = self.verified if block.status == BLOCK_STATUS[1] else self.pending
+        for addr, amount in balances.items():
+            totals[addr] = totals.get(addr, 0) + amount
+
+    def _drop_heights(self, height):
+        dropped = {status for _, status, _ in self.heights[height:]}
+        del self.heights[height:]
+        # totals are summed again in chain order rather than subtracted, so they stay
+        # exactly what a scan of the chain gives; this only happens when the tip changes
+        if BLOCK_STATUS[1] in dropped:
+            self.verified = self._sum_heights(BLOCK_STATUS[1])
+        if BLOCK_STATUS[0] in dropped:
+            self.pending = self._sum_heights(BLOCK_STATUS[0])
+
+    def _sum_heights(self, block_status):
+        totals = {}
+        for _, status, balances in self.heights:
+            if status == block_status:
+                for addr, amount in balances.items():
+                    totals[addr] = totals.get(addr, 0) + amount
+        return totals
+
+    def _pool_entries(self, tx):
+        # same terms as calculate_spendable_balance
+        if tx.type != 0:
+            return []
+        entries = []
+        if tx.output:
+            entries.append((address_of(tx.output[0]), tx.output[1]))
+        if tx.input:
+            entries.append((address_of(tx.input[0]), -tx.input[1]))
+            entries.append((address_of(tx.input[0]), -tx.fee))
+        return entries
+
+balance_index = BalanceIndex(balances_file_path)
+transaction_journal.watch(balance_index)
+
 def view_balance(username):
-        pool_transactions = load_from_file(transactions_file_path)
-        public_key = get_current_user_public_key(username)
-        private_key = None
-
-        #pending balance from pool
-        pending_balance = 0
-        spendable_balance = 0
-        if pool_transactions:
-            spendable_balance += calculate_spendable_balance(public_key, pool_transactions)
-
-        #balance from validated blocks
-        chain = load_from_file(blockchain_file_path)
-        available_balance = 0
-        for block in chain:
-            #add transaction fee to the balance
-            if block.status == BLOCK_STATUS[1] and block.transactions[-1].output[0] == public_key:
-                available_balance += calculate_balance(public_key, block.transactions, True)
-            elif block.status == BLOCK_STATUS[1]:
-                available_balance += calculate_balance(public_key, block.transactions)
-            elif block.status == BLOCK_STATUS[0] and block.transactions[-1].output[0] == public_key:
-                pending_balance += calculate_balance(public_key, block.transactions, True)
-            elif block.status == BLOCK_STATUS[0]: # balance from pending blocks
-                pending_balance += calculate_balance(public_key, block.transactions)
+        address = get_current_user_address(username)
+
+        # balance from validated blocks, pending blocks and the pool
+        available_balance, pending_balance, spendable_balance = balance_index.balances(address)
         
         print(f"Validated balance: {available_balance} coins") 
         if spendable_balance < 0 and pending_balance >= 0: 
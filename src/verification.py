@@ -0,0 +1,47 @@
+import threading
+from mining import MINING_WORKERS, WORKER_CONTEXT
+from utils import verify
+from transaction import CHECK_SIGNATURE, verified_transactions
+
+# Signature checks of a whole chain spread over a pool of worker processes.
+# The jobs come from Transaction.signature_job, only the ECDSA verification runs
+# in the workers; the rest of Transaction.is_valid stays with the caller. The pool
+# is started by the first check that needs it and kept for the later ones.
+
+PARALLEL_MIN_SIGNATURES = 32 # below this handing the jobs to the workers costs more than it saves
+VERIFY_CHUNK = 16 # signatures sent to a worker at a time
+
+_pool_lock = threading.Lock()
+_pool = None
+
+def _verify(job):
+    if job is None:
+        return False
+    message, signature, public_key = job
+    return verify(message, signature, public_key)
+
+def verify_signatures(jobs):
+    if MINING_WORKERS == 1 or len(jobs) < PARALLEL_MIN_SIGNATURES:
+        return [_verify(job) for job in jobs]
+    return _verification_pool().map(_verify, jobs, VERIFY_CHUNK)
+
+def _verification_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = WORKER_CONTEXT.Pool(MINING_WORKERS)
+        return _pool
+
+def verify_blocks(blocks):
+    # one list of results per block, in the order of its transactions;
+    # signatures that passed before are taken from the verified transaction cache
+    digests = [tx.digest() for block in blocks for tx in block.transactions]
+    transactions = [tx for block in blocks for tx in block.transactions]
+    unknown = [i for i, digest in enumerate(digests) if not verified_transactions.passed(digest, CHECK_SIGNATURE)]
+    results = [True] * len(digests)
+    for i, valid in zip(unknown, verify_signatures([transactions[i].signature_job() for i in unknown])):
+        results[i] = valid
+        if valid:
+            verified_transactions.record(digests[i], CHECK_SIGNATURE)
+    results = iter(results)
+    return [[next(results) for _ in block.transactions] for block in blocks]
@@ -1,6 +1,6 @@
-import pickle
-import socket
 import logging
+from protocol import MESSAGE_MINER, MESSAGE_WALLET
+from peers import peer_connections
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -16,30 +16,13 @@ def send_data_to_wallet_servers(*data):
     server_address = (server_ip, wallet_server_port)
 
     try:
-        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client.connect(server_address)
-
-        # Serialize the data
-        serialized_data = pickle.dumps(data)
-        client.sendall(serialized_data)
-
-        client.close()
-    except ConnectionRefusedError as e:
-        logging.error(f"Failed to connect to server: {e}")
+        # framed onto the connection kept open to the server, queued while the server is down
+        peer_connections.send(server_address, MESSAGE_WALLET, data)
     except Exception as e:
         logging.error(f"Error in sending data: {e}")
 
 def send_data_to_miner_servers(data):
     server_address = (server_ip, miner_server_port)
 
-    try:
-        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client.connect(server_address)
-
-        # Serialize the data
-        serialized_data = pickle.dumps(data)
-        client.sendall(serialized_data)
-
-        client.close()
-    except ConnectionRefusedError:
-        exit()
\ No newline at end of file
+    # framed onto the connection kept open to the server, queued while the server is down
+    peer_connections.send(server_address, MESSAGE_MINER, data)
\ No newline at end of file